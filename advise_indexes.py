@@ -0,0 +1,66 @@
+import click
+import json
+import os
+from agent.tools.index_advisor import IndexAdvisor, apply_indexes, copy_database, load_workload, replay
+
+@click.command()
+@click.option('--workload', 'workload_paths', required=True, multiple=True,
+              help='SQL log from run_agent_hybrid.py --sql-log, or an output JSONL with a "sql" field (repeatable)')
+@click.option('--db', default='data/northwind.sqlite', show_default=True, type=click.Path(exists=True, dir_okay=False),
+              help='Database the workload ran against')
+@click.option('--apply', 'apply_to', default=None,
+              help='Create the indexes in a copy of the database at this path and replay the workload on it')
+@click.option('--repeat', default=5, show_default=True, type=click.IntRange(min=1),
+              help='Runs per query when timing the replay (the fastest run counts)')
+@click.option('--report', default=None, help='Write the suggestions and replay timings to this JSON file')
+def main(workload_paths, db, apply_to, repeat, report):
+    """Suggests covering indexes for the SQL the agent ran, and measures them on a copy of the database."""
+    workload = load_workload(workload_paths)
+    print(f"Workload: {len(workload)} distinct queries, {sum(workload.values())} executions")
+
+    advisor = IndexAdvisor(db)
+    advice = advisor.advise(workload)
+    advisor.close()
+    if advice["skipped"]:
+        print(f"Skipped {advice['skipped']} queries that do not compile against {db} (e.g. KPI rollup queries)")
+    if not advice["indexes"]:
+        print("No index suggestions: every query already reads through an index")
+    for index in advice["indexes"]:
+        print(f"{index['sql']};  -- {index['queries']} queries, {index['executions']} executions")
+
+    results = {"workload": list(workload_paths), "db": db, **advice}
+    if apply_to and advice["indexes"]:
+        if os.path.abspath(apply_to) == os.path.abspath(db):
+            raise click.BadParameter("--apply must name a copy, not the source database")
+        copy_database(db, apply_to)
+        before = replay(apply_to, workload, repeat)
+        kept = apply_indexes(apply_to, advice["indexes"], workload)
+        after = replay(apply_to, workload, repeat)
+        print(f"Created {len(kept)} indexes in {apply_to} "
+              f"({len(advice['indexes']) - len(kept)} dropped as unused by the planner)")
+
+        # Weighted by how often each query ran
+        total_before = sum(before[sql] * n for sql, n in workload.items() if sql in before and sql in after)
+        total_after = sum(after[sql] * n for sql, n in workload.items() if sql in before and sql in after)
+        per_query = sorted(
+            ({"sql": sql, "executions": workload[sql], "before_ms": round(before[sql], 3), "after_ms": round(after[sql], 3)}
+             for sql in before if sql in after),
+            key=lambda q: (q["after_ms"] - q["before_ms"]) * q["executions"]
+        )
+        for query in per_query[:10]:
+            print(f"  {query['before_ms']:>8.3f} -> {query['after_ms']:>8.3f} ms  x{query['executions']}  {query['sql'][:80]}")
+        slower = [q for q in per_query if q["after_ms"] > 1.1 * q["before_ms"]]
+        if slower:
+            print(f"  {len(slower)} queries got more than 10% slower")
+        speedup = total_before / total_after if total_after > 0 else 0.0
+        print(f"Workload replay: {total_before:.1f} ms -> {total_after:.1f} ms ({speedup:.2f}x)")
+        results.update(applied_to=apply_to, kept=kept, replay_before_ms=round(total_before, 3),
+                       replay_after_ms=round(total_after, 3), queries=per_query)
+
+    if report:
+        with open(report, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Report written to {report}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from agent.schema_linking import _split_identifier
+
+FIELD_RE = re.compile(r"(\w+)\s*:\s*(\w+)")
+DECIMALS_RE = re.compile(r"round(?:ed)?\s+to\s+(\d+)\s+decimal", re.I)
+# An explicit list length, e.g. "Top 3 products" or "the five largest orders"
+NUMBER_WORDS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10}
+_N = r"(\d+|" + "|".join(NUMBER_WORDS) + r")"
+LIST_SIZE_RE = re.compile(
+    rf"\b(?:top|first|last|bottom)\s+{_N}\b|\b{_N}\s+(?:most|highest|lowest|largest|smallest|best|worst|biggest)\b",
+    re.I
+)
+
+SCALAR_TYPES = {"int", "float", "str"}
+
+class FormatSpec(NamedTuple):
+    kind: str  # "scalar", "object" or "list"
+    scalar_type: Optional[str]
+    fields: List[Tuple[str, str]]
+
+def parse_format_hint(hint: str) -> Optional[FormatSpec]:
+    """Parses hints such as 'int', '{category:str, quantity:int}' or 'list[{product:str, revenue:float}]'.
+
+    Returns None for hints this parser does not understand.
+    """
+    hint = (hint or "").strip()
+    if hint in SCALAR_TYPES:
+        return FormatSpec("scalar", hint, [])
+
+    list_match = re.fullmatch(r"list\[(.*)\]", hint)
+    if list_match:
+        inner = parse_format_hint(list_match.group(1))
+        if inner is None or inner.kind == "list":
+            return None
+        return FormatSpec("list", inner.scalar_type, inner.fields)
+
+    object_match = re.fullmatch(r"\{(.*)\}", hint)
+    if object_match:
+        fields = FIELD_RE.findall(object_match.group(1))
+        if fields and all(t in SCALAR_TYPES for _, t in fields):
+            return FormatSpec("object", None, fields)
+    return None
+
+def _cast(value: Any, type_name: str, decimals: Optional[int]) -> Any:
+    if value is None:
+        raise ValueError("NULL value")
+    if type_name == "int":
+        return int(float(value))
+    if type_name == "float":
+        value = float(value)
+        return round(value, decimals) if decimals is not None else value
+    return str(value)
+
+def _column_for(field: str, columns: List[str]) -> Optional[int]:
+    """Position of the column named (or aliased) after the field, else the one column whose name contains it."""
+    lowered = [c.lower() for c in columns]
+    if lowered.count(field.lower()) == 1:
+        return lowered.index(field.lower())
+    words = _split_identifier(field)
+    partial = [i for i, c in enumerate(columns) if all(w in _split_identifier(c) for w in words)]
+    return partial[0] if len(partial) == 1 else None
+
+def _map_row(row: Tuple, columns: List[str], fields: List[Tuple[str, str]], decimals: Optional[int]) -> Optional[Dict[str, Any]]:
+    """Maps the fields by column name; None when a field has no unambiguous column."""
+    positions = [_column_for(name, columns) for name, _ in fields]
+    if None in positions or len(set(positions)) != len(positions):
+        return None
+    return {name: _cast(row[i], t, decimals) for (name, t), i in zip(fields, positions)}
+
+def list_size(text: str) -> Optional[int]:
+    """Returns the explicit number of items asked for ("top 3", "five largest"), if any."""
+    match = LIST_SIZE_RE.search(text or "")
+    if not match:
+        return None
+    value = (match.group(1) or match.group(2)).lower()
+    return NUMBER_WORDS[value] if value in NUMBER_WORDS else int(value)
+
+def map_result(spec: FormatSpec, sql_result: Dict[str, Any], question: str = "", format_hint: str = "") -> Tuple[bool, Any]:
+    """Builds the typed answer straight from a SQL result when its shape matches the spec.
+
+    Returns (True, answer) on a match and (False, None) when the shape is ambiguous,
+    e.g. several rows for a scalar, columns that do not name the hint's fields, or a
+    list whose length the question or hint does not state explicitly.
+    """
+    if not sql_result or sql_result.get("error") or sql_result.get("truncated"):
+        return False, None
+    rows = sql_result.get("rows") or []
+    columns = sql_result.get("columns") or []
+    decimals_match = DECIMALS_RE.search(question)
+    decimals = int(decimals_match.group(1)) if decimals_match else None
+
+    try:
+        if spec.kind == "scalar":
+            if len(rows) != 1 or len(rows[0]) != 1:
+                return False, None
+            return True, _cast(rows[0][0], spec.scalar_type, decimals)
+
+        if spec.kind == "object":
+            if len(rows) != 1:
+                return False, None
+            mapped = _map_row(rows[0], columns, spec.fields, decimals)
+            return mapped is not None, mapped
+
+        expected = list_size(question) or list_size(format_hint)
+        if not rows or len(rows) != expected:
+            return False, None
+        if spec.fields:
+            mapped = [_map_row(row, columns, spec.fields, decimals) for row in rows]
+            if any(item is None for item in mapped):
+                return False, None
+            return True, mapped
+        if any(len(row) != 1 for row in rows):
+            return False, None
+        return True, [_cast(row[0], spec.scalar_type, decimals) for row in rows]
+    except (TypeError, ValueError):
+        return False, None
+
+def tables_in_sql(sql: str, tables: List[str]) -> List[str]:
+    """Returns the known tables referenced by the SQL, in order of first appearance."""
+    found = []
+    for table in tables:
+        match = re.search(r'(?<![\w"])"?' + re.escape(table) + r'"?(?![\w"])', sql or "", re.I)
+        if match:
+            found.append((match.start(), table))
+    return [table for _, table in sorted(found)]
@@ -0,0 +1,116 @@
+import re
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, NamedTuple
+
+if TYPE_CHECKING:
+    # Imported for annotations only; numpy is loaded with the retriever itself
+    from agent.rag.retrieval import Retriever
+
+# Questions that only ask about a written policy
+POLICY_RE = re.compile(r"\b(according to|per|under) the (product |return )?polic(y|ies)\b|\breturn (window|policy)\b", re.I)
+
+# Explicit references to a definition that lives in docs/
+DOC_REF_RE = re.compile(r"\b(marketing calendar|kpi (definition|docs?)|as defined in|per the (kpi|definition))\b", re.I)
+
+# Metrics and aggregates that need the database
+METRIC_RE = re.compile(
+    r"\b(revenue|aov|average order value|gross margin|margin|quantity|sales|sold|orders?|count|"
+    r"how many|total|sum|average|top \d+|highest|lowest|most|least)\b",
+    re.I
+)
+
+QUOTED_RE = re.compile(r"'([^']+)'|\"([^\"]+)\"")
+
+class RouteDecision(NamedTuple):
+    classification: Optional[str]
+    confidence: float
+    tier: str
+
+def _singular(word: str) -> str:
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+class FastRouter:
+    """Cheap tiered classifier that runs before the LLM router.
+
+    Tier "rules" uses keyword/regex patterns and doc headings. Tier "scores" combines
+    the best BM25 score against docs/ with table/column name matches from the schema.
+    When neither reaches min_confidence, classify() returns a decision with
+    classification None and the caller falls back to the LLM.
+    """
+
+    def __init__(
+        self,
+        retriever: "Retriever",
+        table_columns: Dict[str, List[Tuple[str, str]]],
+        min_confidence: float = 0.75,
+        doc_score_threshold: float = 1.5
+    ):
+        self.retriever = retriever
+        self.min_confidence = min_confidence
+        self.doc_score_threshold = doc_score_threshold
+
+        # Section headings (e.g. campaign names, KPI names) identify doc references
+        self.doc_headings = set()
+        for chunk in retriever.chunks:
+            for line in chunk["content"].splitlines():
+                if line.startswith("#"):
+                    self.doc_headings.add(line.lstrip("#").strip().lower())
+
+        # Singularized table and column names, e.g. "order details" -> "order detail"
+        self.schema_terms = set()
+        for table, columns in table_columns.items():
+            if table.startswith("sqlite_"):
+                continue
+            self.schema_terms.add(_singular(table.lower()))
+            for name, _ in columns:
+                self.schema_terms.add(_singular(name.lower()))
+
+    def _has_doc_reference(self, question: str) -> bool:
+        if DOC_REF_RE.search(question):
+            return True
+        lowered = question.lower()
+        for match in QUOTED_RE.finditer(question):
+            quoted = (match.group(1) or match.group(2)).lower()
+            if any(quoted in heading for heading in self.doc_headings):
+                return True
+        return any(heading in lowered for heading in self.doc_headings if len(heading) > 8)
+
+    def _schema_hits(self, question: str) -> int:
+        words = [_singular(w) for w in re.findall(r"[a-z]+", question.lower())]
+        hits = sum(1 for w in words if w in self.schema_terms)
+        # Multi-word table names such as "Order Details"
+        pairs = {f"{a} {b}" for a, b in zip(words, words[1:])}
+        return hits + len(pairs & self.schema_terms)
+
+    def classify(self, question: str) -> RouteDecision:
+        has_metric = bool(METRIC_RE.search(question))
+        doc_ref = self._has_doc_reference(question)
+
+        # Tier 1: rules
+        if POLICY_RE.search(question) and not has_metric:
+            return RouteDecision("rag", 0.95, "rules")
+        if doc_ref and has_metric:
+            return RouteDecision("hybrid", 0.9, "rules")
+
+        # Tier 2: BM25 against docs/ and schema-name matches
+        top = self.retriever.retrieve(question, k=1)
+        doc_score = top[0]["score"] if top else 0.0
+        schema_hits = self._schema_hits(question)
+        has_doc = doc_ref or doc_score >= self.doc_score_threshold
+        has_db = schema_hits > 0 or has_metric
+
+        if has_db and not has_doc:
+            decision = RouteDecision("sql", 0.85 if schema_hits else 0.6, "scores")
+        elif has_doc and not has_db:
+            decision = RouteDecision("rag", 0.8 if doc_ref else 0.65, "scores")
+        elif has_doc and has_db:
+            decision = RouteDecision("hybrid", 0.8 if doc_ref else 0.6, "scores")
+        else:
+            decision = RouteDecision(None, 0.0, "scores")
+
+        if decision.confidence < self.min_confidence:
+            return RouteDecision(None, decision.confidence, "llm")
+        return decision
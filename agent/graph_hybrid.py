@@ -1,26 +1,43 @@
 import os
-import dspy
+import sqlite3
+import threading
+import time
 from typing import TypedDict, Annotated, List, Dict, Any, Union, Optional
-from langgraph.graph import StateGraph, END
 from agent.tools.sqlite_tool import SQLiteTool
-from agent.rag.retrieval import Retriever
-from agent.dspy_signatures import CoT_Router, CoT_SQL, CoT_Synthesizer, CoT_Planner
+from agent.tools.query_cache import QueryCache
+from agent.tools.index_advisor import WorkloadLog
+from agent.tools.result_encoding import format_result, json_safe, result_stats
+from agent.rag.context import format_context, context_stats
+from agent.fast_router import FastRouter
+from agent.schema_linking import VALUE_COLUMNS, SchemaLinker
+from agent.sql_validation import SQLValidator
+from agent.answer_mapping import parse_format_hint, map_result, tables_in_sql
+from agent.rollups import read_calendar, rollup_sources
+from agent.tracing import Tracer, record
 
 # Define State
 class AgentState(TypedDict):
+    question_id: str
     question: str
     format_hint: str
     classification: str
+    route_tier: str
     plan: str
     sql_query: Optional[str]
+    schema_stats: Dict[str, int]
+    sql_fixes: List[str]
     sql_result: Optional[Dict[str, Any]]
+    result_stats: Dict[str, int]
     retrieved_docs: List[Dict[str, Any]]
+    context: str
+    context_stats: Dict[str, int]
     final_answer: Any
     explanation: str
     citations: List[str]
     confidence: float
     error: Optional[str]
     repair_count: int
+    draft: Optional[Dict[str, Any]]
 
 # Initialize Tools and Modules
 # Note: These should be initialized with proper paths in the main execution flow or passed in.
@@ -28,58 +45,265 @@ class AgentState(TypedDict):
 # Better to initialize them outside and pass them to the graph creation function.
 
 class HybridAgent:
-    def __init__(self, db_path: str, docs_dir: str):
-        self.db_tool = SQLiteTool(db_path)
-        self.retriever = Retriever(docs_dir)
-        self.schema = self.db_tool.get_schema()
-        
-        # DSPy Modules
-        self.router = CoT_Router()
-        self.planner = CoT_Planner()
-        
-        # Load optimized SQL generator if available
-        self.sql_gen = CoT_SQL()
-        if os.path.exists("agent/optimized_sql_gen.json"):
-            print("Loading optimized SQL generator...")
-            self.sql_gen.load("agent/optimized_sql_gen.json")
-            
-        self.synthesizer = CoT_Synthesizer()
-        
-        # Build Graph
-        self.app = self.build_graph()
-    
+    """The hybrid RAG + SQL agent.
+
+    Heavy components (retriever index, schema, DSPy modules, the compiled graph) are
+    built on first use, so constructing the agent is cheap. startup_times records
+    how long each one took to build.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        docs_dir: str,
+        query_cache_path: Optional[str] = None,
+        llm_cache_path: Optional[str] = "llm_cache.sqlite",
+        index_dir: Optional[str] = ".retrieval_index",
+        context_budget: int = 512,
+        tracer: Optional[Tracer] = None,
+        use_rollups: bool = True,
+        sql_log_path: Optional[str] = None,
+        speculative: bool = False
+    ):
+        self.docs_dir = docs_dir
+        self.index_dir = index_dir
+        self.llm_cache_path = llm_cache_path
+        self.context_budget = context_budget
+        self.use_rollups = use_rollups
+        # Run routing, retrieval and an SQL draft in parallel (see build_graph)
+        self.speculative = speculative
+        # Per-node timing and counters; None registers the nodes unwrapped
+        self.tracer = tracer
+        self.rollups_path = os.path.splitext(db_path)[0] + "_rollups.sqlite"
+        # Rollup queries read the sidecar, so a rebuilt sidecar invalidates cached results too
+        self.query_cache = QueryCache(db_path, disk_path=query_cache_path,
+                                      watch_paths=[self.rollups_path] if use_rollups else [])
+        self.db_tool = SQLiteTool(db_path, cache=self.query_cache)
+        # Every executed query, for the index advisor (advise_indexes.py); None disables it
+        self.sql_log = WorkloadLog(sql_log_path) if sql_log_path else None
+
+        # {component: seconds to build}, filled in as components are first used
+        self.startup_times = {}
+        self._components = {}
+        self._init_lock = threading.RLock()
+
+        # {tier: (questions, total routing seconds)} to measure latency saved by the fast path
+        self.route_stats = {}
+        self.context_totals = {"questions": 0, "raw_tokens": 0, "context_tokens": 0}
+        self.schema_totals = {"calls": 0, "full_tokens": 0, "schema_tokens": 0}
+        # "repaired_locally" counts LLM repair round-trips avoided by the validator
+        self.validation_stats = {"checked": 0, "valid": 0, "repaired_locally": 0, "sent_to_llm": 0}
+        self.synthesis_stats = {"deterministic": 0, "llm": 0}
+        # Compact SQL result rendering vs the previous str(result) in synthesizer prompts
+        self.result_totals = {"questions": 0, "raw_bytes": 0, "prompt_bytes": 0, "raw_tokens": 0, "prompt_tokens": 0}
+        # Questions whose SQL was written against the KPI rollups instead of by the LLM
+        self.rollup_stats = {"matched": 0}
+        # Speculative graph only: what happened to the work started before routing finished
+        self.speculation_stats = {"drafts_used": 0, "drafts_discarded": 0, "drafts_skipped": 0, "retrievals_discarded": 0}
+        self._stats_lock = threading.Lock()
+
+    def _component(self, name: str, build):
+        """Returns the named component, building it (once, thread-safely) on first use."""
+        if name in self._components:
+            return self._components[name]
+        with self._init_lock:
+            if name not in self._components:
+                start = time.perf_counter()
+                value = build()
+                self.startup_times[name] = time.perf_counter() - start
+                self._components[name] = value
+        return self._components[name]
+
+    def warm_up(self):
+        """Builds every component now, in dependency order, e.g. before timing a batch."""
+        for name in ("table_columns", "schema", "retriever", "fast_router", "schema_linker",
+                     "sql_validator", "rollups", "llm_cache", "router", "planner", "sql_gen", "synthesizer", "app"):
+            getattr(self, name)
+        return self.startup_times
+
+    def close(self):
+        """Closes the LLM cache (if it was opened), the SQL log and the database connections."""
+        llm_cache = self._components.get("llm_cache")
+        if llm_cache is not None:
+            llm_cache.close()
+        if self.sql_log is not None:
+            self.sql_log.close()
+        self.db_tool.close()
+
+    @property
+    def retriever(self):
+        from agent.rag.retrieval import Retriever
+        return self._component("retriever", lambda: Retriever(self.docs_dir, index_dir=self.index_dir))
+
+    @property
+    def table_columns(self):
+        return self._component("table_columns", self.db_tool.get_table_columns)
+
+    @property
+    def schema(self):
+        return self._component("schema", self.db_tool.get_schema)
+
+    @property
+    def fast_router(self):
+        return self._component("fast_router", lambda: FastRouter(self.retriever, self.table_columns))
+
+    @property
+    def schema_linker(self):
+        return self._component("schema_linker", lambda: SchemaLinker(
+            self.table_columns, self.db_tool.get_foreign_keys(), full_schema=self.schema,
+            window_names=[name for name, _, _ in read_calendar(self.docs_dir)],
+            values=self._link_values()
+        ))
+
+    def _link_values(self) -> Dict[str, List[str]]:
+        # Product, category and customer names, so questions naming one link its table
+        values = {}
+        for table, column in VALUE_COLUMNS.items():
+            if table in self.table_columns:
+                result = self.db_tool.execute_query(f'SELECT DISTINCT "{column}" FROM "{table}"')
+                if not result.get("error"):
+                    values[table] = [row[0] for row in result["rows"]]
+        return values
+
+    @property
+    def sql_validator(self):
+        return self._component("sql_validator", lambda: SQLValidator(self.db_tool, self.table_columns))
+
+    @property
+    def rollups(self):
+        # Precomputed KPI rollups, attached to every connection as database "kpi"; None when disabled
+        def build():
+            if not self.use_rollups:
+                return None
+            from agent.rollups import KPIRollups
+            rollups = KPIRollups(self.db_tool.db_path, self.docs_dir, self.rollups_path)
+            try:
+                stats = rollups.refresh()
+            except (sqlite3.Error, OSError) as e:
+                # e.g. a read-only data/ directory; every question goes through SQL generation
+                print(f"KPI rollups unavailable ({e}), continuing without them")
+                return None
+            print(f"KPI rollups: {stats['windows']} windows ({stats['rebuilt']} rebuilt, {stats['reused']} up to date)")
+            self.db_tool.attach("kpi", rollups.path)
+            return rollups
+        return self._component("rollups", build)
+
+    def _rollup_sql(self, question: str, format_hint: str) -> Optional[str]:
+        rollups = self.rollups
+        if rollups is None:
+            return None
+        if rollups.is_stale():
+            try:
+                rollups.refresh()
+            except (sqlite3.Error, OSError) as e:
+                # The attached rollups are out of date; generate this question's SQL instead
+                print(f"KPI rollups refresh failed ({e}), generating SQL instead")
+                return None
+        return rollups.match(question, format_hint)
+
+    @property
+    def llm_cache(self):
+        # LLM-call cache shared by all DSPy modules; None bypasses it (e.g. evaluation runs)
+        from agent.llm_cache import LLMCache
+        return self._component("llm_cache", lambda: LLMCache(self.llm_cache_path) if self.llm_cache_path else None)
+
+    def _module(self, name: str, build):
+        def build_cached():
+            from agent.llm_cache import CachedModule
+            return CachedModule(name, build(), self.llm_cache)
+        return self._component(name, build_cached)
+
+    @property
+    def router(self):
+        from agent.dspy_signatures import CoT_Router
+        return self._module("router", CoT_Router)
+
+    @property
+    def planner(self):
+        from agent.dspy_signatures import CoT_Planner
+        return self._module("planner", CoT_Planner)
+
+    @property
+    def sql_gen(self):
+        def build():
+            from agent.dspy_signatures import CoT_SQL
+            # Load optimized SQL generator if available
+            sql_gen = CoT_SQL()
+            if os.path.exists("agent/optimized_sql_gen.json"):
+                print("Loading optimized SQL generator...")
+                sql_gen.load("agent/optimized_sql_gen.json")
+            return sql_gen
+        return self._module("sql_gen", build)
+
+    @property
+    def synthesizer(self):
+        from agent.dspy_signatures import CoT_Synthesizer
+        return self._module("synthesizer", CoT_Synthesizer)
+
+    @property
+    def app(self):
+        """The compiled graph, shared by every caller (and every worker thread)."""
+        return self._component("app", self.build_graph)
+
     def build_graph(self):
+        """Compiles a new graph. Use the shared self.app unless the tracer changed."""
+        # langgraph is slow to import; only pay for it when a graph is needed
+        from langgraph.graph import StateGraph, START, END
+
         workflow = StateGraph(AgentState)
         
-        workflow.add_node("router", self.route_question)
-        workflow.add_node("retriever", self.retrieve_docs)
-        workflow.add_node("planner", self.plan_execution)
-        workflow.add_node("sql_generator", self.generate_sql)
-        workflow.add_node("executor", self.execute_sql)
-        workflow.add_node("synthesizer", self.synthesize_answer)
-        workflow.add_node("repair", self.repair_action)
-        
-        workflow.set_entry_point("router")
-        
-        workflow.add_conditional_edges(
-            "router",
-            self.decide_route,
-            {
-                "rag": "retriever",
-                "sql": "sql_generator",
-                "hybrid": "retriever"
-            }
-        )
-        
-        # RAG flow: Retriever -> Planner -> Synthesizer (Planner helps extract constraints even for RAG)
-        # SQL flow: SQL Generator -> Executor -> Synthesizer
-        # Hybrid flow: Retriever -> Planner -> SQL Generator -> Executor -> Synthesizer
-        
-        workflow.add_conditional_edges(
-            "retriever",
-            lambda state: "planner",
-            {"planner": "planner"}
-        )
+        nodes = {
+            "router": self.route_question,
+            "retriever": self.retrieve_docs,
+            "planner": self.plan_execution,
+            "sql_generator": self.generate_sql,
+            "validator": self.validate_sql,
+            "executor": self.execute_sql,
+            "synthesizer": self.synthesize_answer,
+            "repair": self.repair_action
+        }
+        if self.speculative:
+            nodes["sql_draft"] = self.draft_sql
+            nodes["join"] = self.join_speculation
+        for name, fn in nodes.items():
+            workflow.add_node(name, self.tracer.wrap(name, fn) if self.tracer else fn)
+
+        if self.speculative:
+            # Routing, retrieval and an SQL draft start together; join keeps what the route needs
+            for name in ("router", "retriever", "sql_draft"):
+                workflow.add_edge(START, name)
+            workflow.add_edge(["router", "retriever", "sql_draft"], "join")
+            workflow.add_conditional_edges(
+                "join",
+                self.after_speculation,
+                {
+                    "planner": "planner",
+                    "sql_generator": "sql_generator",
+                    "validator": "validator"
+                }
+            )
+        else:
+            workflow.set_entry_point("router")
+
+            workflow.add_conditional_edges(
+                "router",
+                self.decide_route,
+                {
+                    "rag": "retriever",
+                    "sql": "sql_generator",
+                    "hybrid": "retriever"
+                }
+            )
+
+            # RAG flow: Retriever -> Planner -> Synthesizer (Planner helps extract constraints even for RAG)
+            # SQL flow: SQL Generator -> Validator -> Executor -> Synthesizer
+            # Hybrid flow: Retriever -> Planner -> SQL Generator -> Validator -> Executor -> Synthesizer
+
+            workflow.add_conditional_edges(
+                "retriever",
+                lambda state: "planner",
+                {"planner": "planner"}
+            )
         
         workflow.add_conditional_edges(
             "planner",
@@ -90,7 +314,17 @@ class HybridAgent:
             }
         )
         
-        workflow.add_edge("sql_generator", "executor")
+        workflow.add_edge("sql_generator", "validator")
+
+        # Validator fixes what it can locally; only unfixable SQL goes to the LLM repair loop
+        workflow.add_conditional_edges(
+            "validator",
+            self.check_validation,
+            {
+                "executor": "executor",
+                "repair": "repair"
+            }
+        )
         
         workflow.add_conditional_edges(
             "executor",
@@ -116,56 +350,188 @@ class HybridAgent:
 
     def route_question(self, state: AgentState):
         print(f"Routing question: {state['question']}")
-        try:
-            pred = self.router(question=state['question'])
-            classification = pred.classification.lower() if hasattr(pred, 'classification') else "hybrid"
-            if classification not in ["rag", "sql", "hybrid"]:
+        start = time.perf_counter()
+        decision = self.fast_router.classify(state['question'])
+        if decision.classification:
+            classification = decision.classification
+        else:
+            try:
+                pred = self.router(question=state['question'])
+                classification = pred.classification.lower() if hasattr(pred, 'classification') else "hybrid"
+                if classification not in ["rag", "sql", "hybrid"]:
+                    classification = "hybrid"
+            except Exception as e:
+                print(f"Router error: {e}, defaulting to hybrid")
                 classification = "hybrid"
-            return {"classification": classification}
-        except Exception as e:
-            print(f"Router error: {e}, defaulting to hybrid")
-            return {"classification": "hybrid"}
+        self._record_route(decision.tier, time.perf_counter() - start)
+        return {"classification": classification, "route_tier": decision.tier}
+
+    def _record_synthesis(self, path: str):
+        with self._stats_lock:
+            self.synthesis_stats[path] += 1
+
+    def _record_route(self, tier: str, seconds: float):
+        with self._stats_lock:
+            count, total = self.route_stats.get(tier, (0, 0.0))
+            self.route_stats[tier] = (count + 1, total + seconds)
 
     def decide_route(self, state: AgentState):
         return state["classification"]
 
+    def draft_sql(self, state: AgentState):
+        """Speculative graph only: writes SQL while the router and retriever are still running.
+
+        Rollup SQL does not depend on the plan, so it serves every SQL route. An LLM
+        draft is written without a plan, exactly as the sql route would write it, and is
+        skipped when the cheap router tiers already rule the sql route out.
+        """
+        print("Drafting SQL...")
+        try:
+            update = self._rollup_update(state)
+        except Exception as e:
+            print(f"Rollup draft error: {e}")
+            update = None
+        if update:
+            return {"draft": {"source": "rollups", "update": update}}
+
+        decision = self.fast_router.classify(state["question"])
+        if decision.classification in ("rag", "hybrid"):
+            with self._stats_lock:
+                self.speculation_stats["drafts_skipped"] += 1
+            return {"draft": None}
+        return {"draft": {"source": "llm", "update": self.generate_sql(state)}}
+
+    def join_speculation(self, state: AgentState):
+        """Keeps the speculative work the chosen route needs and discards the rest."""
+        route = state["classification"]
+        draft = state.get("draft")
+        update = {}
+        if draft is not None:
+            used = route == "sql" or (route == "hybrid" and draft["source"] == "rollups")
+            update["draft"] = {**draft, "used": used}
+            if used:
+                update.update(draft["update"])
+        # The sequential sql route never retrieves; drop the documents so answers and citations match it
+        if route == "sql":
+            update.update(retrieved_docs=[], context="", context_stats={})
+        with self._stats_lock:
+            if draft is not None:
+                self.speculation_stats["drafts_used" if update["draft"]["used"] else "drafts_discarded"] += 1
+            if route == "sql":
+                self.speculation_stats["retrievals_discarded"] += 1
+        return update
+
+    def after_speculation(self, state: AgentState):
+        draft = state.get("draft")
+        if draft is not None and draft["used"]:
+            return "validator"
+        return "sql_generator" if state["classification"] == "sql" else "planner"
+
     def retrieve_docs(self, state: AgentState):
         print("Retrieving docs...")
         docs = self.retriever.retrieve(state["question"])
-        return {"retrieved_docs": docs}
+        # Compact, budgeted rendering shared by the planner and synthesizer prompts
+        context = format_context(docs, self.context_budget)
+        stats = context_stats(docs, context)
+        with self._stats_lock:
+            self.context_totals["questions"] += 1
+            self.context_totals["raw_tokens"] += stats["raw_tokens"]
+            self.context_totals["context_tokens"] += stats["context_tokens"]
+        return {"retrieved_docs": docs, "context": context, "context_stats": stats}
 
     def plan_execution(self, state: AgentState):
         print("Planning execution...")
         try:
-            retrieved_docs = str(state.get("retrieved_docs", []))
-            pred = self.planner(question=state["question"], retrieved_docs=retrieved_docs)
+            pred = self.planner(question=state["question"], retrieved_docs=state.get("context", ""))
             plan = pred.plan if hasattr(pred, 'plan') else str(pred)
             return {"plan": plan}
         except Exception as e:
             print(f"Planner error: {e}, using basic plan")
             return {"plan": f"Answer the question: {state['question']}"}
 
+    def _rollup_update(self, state: AgentState) -> Optional[Dict[str, Any]]:
+        sql_query = self._rollup_sql(state["question"], state["format_hint"])
+        if not sql_query:
+            return None
+        print("Using precomputed KPI rollups")
+        with self._stats_lock:
+            self.rollup_stats["matched"] += 1
+        return {"sql_query": sql_query, "schema_stats": {}}
+
     def generate_sql(self, state: AgentState):
         print("Generating SQL...")
         try:
+            # KPI lookups over a campaign window, a year or all-time read the rollups directly.
+            # A repair round means the rollup query did not fit, so it goes to the LLM.
+            if not state.get("repair_count"):
+                update = self._rollup_update(state)
+                if update:
+                    return update
+
+            # Only the tables (and FK join paths) relevant to this question and plan; repair
+            # rounds get the full schema in case linking missed a table
+            db_schema, schema_stats = self.schema_linker.prune(
+                state["question"], state.get("plan", ""), full=bool(state.get("repair_count"))
+            )
+            with self._stats_lock:
+                self.schema_totals["calls"] += 1
+                self.schema_totals["full_tokens"] += schema_stats["full_tokens"]
+                self.schema_totals["schema_tokens"] += schema_stats["schema_tokens"]
+            if self.rollups is not None:
+                db_schema += self.rollups.describe(state["question"])
+
             pred = self.sql_gen(
                 question=state["question"], 
-                db_schema=self.schema, 
+                db_schema=db_schema, 
                 plan=state.get("plan", "")
             )
             sql_query = pred.sql_query if hasattr(pred, 'sql_query') else str(pred)
-            return {"sql_query": sql_query}
+            return {"sql_query": sql_query, "schema_stats": schema_stats}
         except Exception as e:
             print(f"SQL generation error: {e}")
             # Fallback: set error to trigger repair or skip SQL
             return {"sql_query": None, "error": f"SQL generation failed: {str(e)}"}
 
+    def validate_sql(self, state: AgentState):
+        print("Validating SQL...")
+        if not state.get("sql_query"):
+            return {"error": state.get("error") or "No SQL query was generated"}
+
+        sql_query, error, fixes = self.sql_validator.validate(state["sql_query"])
+        with self._stats_lock:
+            self.validation_stats["checked"] += 1
+            if error:
+                self.validation_stats["sent_to_llm"] += 1
+            elif fixes:
+                self.validation_stats["repaired_locally"] += 1
+            else:
+                self.validation_stats["valid"] += 1
+        if fixes:
+            print(f"Local SQL fixes: {fixes}")
+        return {"sql_query": sql_query, "error": error, "sql_fixes": state.get("sql_fixes", []) + fixes}
+
     def execute_sql(self, state: AgentState):
         print(f"Executing SQL: {state['sql_query']}")
         result = self.db_tool.execute_query(state["sql_query"])
+        if self.sql_log is not None:
+            self.sql_log.record(state["sql_query"], result)
         error = result.get("error")
+        if error is None:
+            print(f"Fetched {result['row_count']} rows in {result['elapsed_ms']} ms"
+                  + (" (truncated)" if result["truncated"] else ""))
+            # Hitting the row/byte cap when a single value or object is expected means
+            # the query is not aggregating; send it back for repair
+            if result["truncated"] and not state["format_hint"].startswith("list"):
+                error = (f"Query returned more than {result['row_count']} rows but a single "
+                         f"{state['format_hint']} answer is expected; aggregate the result or add a LIMIT.")
         return {"sql_result": result, "error": error}
 
+    def check_validation(self, state: AgentState):
+        if state.get("error"):
+            print(f"Validation Error: {state['error']}")
+            return "repair"
+        return "executor"
+
     def check_execution(self, state: AgentState):
         if state.get("error"):
             print(f"Execution Error: {state['error']}")
@@ -191,36 +557,61 @@ class HybridAgent:
         print("Synthesizing answer...")
         
         sql_query = state.get("sql_query", "")
-        sql_result = str(state.get("sql_result", ""))
-        retrieved_docs = str(state.get("retrieved_docs", []))
-        
-        try:
-            pred = self.synthesizer(
-                question=state["question"],
-                sql_query=sql_query,
-                sql_result=sql_result,
-                retrieved_docs=retrieved_docs,
-                format_hint=state["format_hint"]
-            )
-            
-            final_answer = pred.final_answer if hasattr(pred, 'final_answer') else None
-            explanation = pred.explanation if hasattr(pred, 'explanation') else "Generated answer"
-            citations = pred.citations if hasattr(pred, 'citations') else []
-        except Exception as e:
-            print(f"Synthesizer error: {e}, using fallback")
-            # Fallback: try to extract answer from SQL result
-            final_answer = "Error generating answer"
-            explanation = f"Synthesis failed: {str(e)}"
-            citations = []
-            
-            if sql_result and "rows" in sql_result:
-                try:
-                    result_dict = eval(sql_result)
-                    if result_dict.get("rows"):
-                        final_answer = result_dict["rows"][0][0] if result_dict["rows"][0] else None
-                except:
-                    pass
-        
+        result = state.get("sql_result") or {}
+        retrieved_docs = state.get("context", "")
+
+        # When the SQL result already has the shape of the answer, build it directly
+        # and skip the synthesizer LLM call
+        spec = parse_format_hint(state["format_hint"])
+        matched, mapped = (False, None)
+        stats = {}
+        if spec is not None and state.get("classification") != "rag":
+            matched, mapped = map_result(spec, result, state["question"], state["format_hint"])
+        if matched:
+            self._record_synthesis("deterministic")
+            tables = tables_in_sql(sql_query, self.sql_validator.tables) or rollup_sources(sql_query)
+            docs = state.get("retrieved_docs", [])
+            top_score = max((doc.get("score", 0) for doc in docs), default=0)
+            # Cite only the chunks that clearly matched the question (e.g. the campaign or KPI definition)
+            doc_ids = [doc["id"] for doc in docs if top_score > 0 and doc.get("score", 0) >= 0.5 * top_score]
+            final_answer = mapped
+            explanation = f"Computed directly from the SQL result over {', '.join(tables) or 'the database'}."
+            citations = tables + doc_ids
+        else:
+            self._record_synthesis("llm")
+            # Compact CSV rendering with head/tail sampling instead of str() of the result dict
+            sql_result = format_result(result)
+            # RAG questions have no SQL result to encode, so nothing was saved
+            if result:
+                stats = result_stats(result, sql_result)
+                with self._stats_lock:
+                    self.result_totals["questions"] += 1
+                    for key in ("raw_bytes", "prompt_bytes", "raw_tokens", "prompt_tokens"):
+                        self.result_totals[key] += stats[key]
+                record(result_bytes_saved=stats["raw_bytes"] - stats["prompt_bytes"], result_tokens_saved=stats["saved_tokens"])
+            try:
+                pred = self.synthesizer(
+                    question=state["question"],
+                    sql_query=sql_query,
+                    sql_result=sql_result,
+                    retrieved_docs=retrieved_docs,
+                    format_hint=state["format_hint"]
+                )
+
+                final_answer = pred.final_answer if hasattr(pred, 'final_answer') else None
+                explanation = pred.explanation if hasattr(pred, 'explanation') else "Generated answer"
+                citations = pred.citations if hasattr(pred, 'citations') else []
+            except Exception as e:
+                print(f"Synthesizer error: {e}, using fallback")
+                # Fallback: take the first value of the SQL result
+                final_answer = "Error generating answer"
+                explanation = f"Synthesis failed: {str(e)}"
+                citations = []
+
+                rows = result.get("rows") or []
+                if rows and rows[0]:
+                    final_answer = json_safe(rows[0][0])
+
         # Basic type conversion
         try:
             if state["format_hint"] == "int":
@@ -232,6 +623,9 @@ class HybridAgent:
             
         if isinstance(citations, str):
             citations = [c.strip() for c in citations.split(',')]
+        # The record is written to outputs_hybrid.jsonl as-is
+        final_answer = json_safe(final_answer)
+        citations = [str(c) for c in citations]
             
         # Calculate Confidence
         confidence = 1.0
@@ -248,7 +642,8 @@ class HybridAgent:
             "final_answer": final_answer,
             "explanation": explanation,
             "citations": citations,
-            "confidence": round(confidence, 2)
+            "confidence": round(confidence, 2),
+            "result_stats": stats
         }
     
     def invoke(self, state):
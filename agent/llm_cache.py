@@ -0,0 +1,197 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Optional
+import dspy
+from agent.rag.chunking import count_tokens
+from agent.tracing import active, record
+
+def _stable_json(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, default=str)
+
+def demos_fingerprint(module: dspy.Module) -> str:
+    """Hashes the module's learned state (demos, instructions), e.g. a loaded optimized_sql_gen.json."""
+    try:
+        state = module.dump_state()
+    except Exception:
+        state = [[str(demo) for demo in predictor.demos] for _, predictor in module.named_predictors()]
+    return hashlib.sha256(_stable_json(state).encode("utf-8")).hexdigest()
+
+def _record_usage(pred: dspy.Prediction, inputs: Dict[str, Any]):
+    """Reports the call's token counts to the active trace span.
+
+    Uses the LM's reported usage (dspy track_usage) when available, otherwise an
+    estimate from the prompt inputs and the outputs.
+    """
+    if not active():
+        return
+    usage = {}
+    try:
+        usage = pred.get_lm_usage() or {}
+    except AttributeError:
+        pass
+    prompt = sum((u or {}).get("prompt_tokens") or 0 for u in usage.values())
+    completion = sum((u or {}).get("completion_tokens") or 0 for u in usage.values())
+    if not prompt and not completion:
+        prompt = count_tokens(_stable_json(inputs))
+        completion = count_tokens(_stable_json(dict(pred.items())))
+        record(estimated_tokens=1)
+    record(llm_calls=1, prompt_tokens=prompt, completion_tokens=completion)
+
+def lm_fingerprint() -> str:
+    lm = dspy.settings.lm
+    if lm is None:
+        return ""
+    return _stable_json({"model": getattr(lm, "model", repr(lm)), "kwargs": getattr(lm, "kwargs", {})})
+
+class LLMCache:
+    """Persistent, content-addressed store of module outputs backed by a SQLite file.
+
+    Entries older than ttl_seconds are ignored and purged. When the store grows past
+    max_entries or max_bytes, the least recently used entries are evicted.
+    """
+
+    def __init__(
+        self,
+        path: str = "llm_cache.sqlite",
+        ttl_seconds: float = 30 * 24 * 3600,
+        max_entries: int = 100_000,
+        max_bytes: int = 512 * 1024 * 1024
+    ):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+        self._lock = threading.Lock()
+        self._puts = 0
+        # {key: last hit time} not yet written, flushed every access_flush_every hits and on close
+        self._accessed: Dict[str, float] = {}
+        self.access_flush_every = 256
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL;")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, module TEXT, outputs TEXT, created REAL, last_access REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache(last_access)")
+        self._conn.commit()
+        with self._lock:
+            self._evict()
+
+    @staticmethod
+    def make_key(module_name: str, inputs: Dict[str, Any], demos: str, lm_config: str) -> str:
+        payload = _stable_json({"module": module_name, "inputs": inputs, "demos": demos, "lm": lm_config})
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT outputs FROM llm_cache WHERE key = ? AND created >= ?",
+                    (key, now - self.ttl_seconds)
+                ).fetchone()
+            except sqlite3.OperationalError:
+                # Locked by another worker process; calling the LM is always correct
+                row = None
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            # last_access only orders LRU eviction; batch the writes instead of committing per hit
+            self._accessed[key] = now
+            if len(self._accessed) >= self.access_flush_every:
+                self._flush_accessed()
+            self.stats["hits"] += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, module_name: str, outputs: Dict[str, Any]):
+        now = time.time()
+        with self._lock:
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?)",
+                    (key, module_name, json.dumps(outputs, default=str), now, now)
+                )
+                self._conn.commit()
+                self._puts += 1
+                if self._puts % 100 == 0:
+                    self._evict()
+            except sqlite3.OperationalError:
+                # Locked by another worker process; skip the write, the answer is still returned
+                self._conn.rollback()
+
+    def _flush_accessed(self):
+        """Writes the batched last_access times. Caller holds the lock."""
+        accessed, self._accessed = self._accessed, {}
+        try:
+            self._conn.executemany("UPDATE llm_cache SET last_access = ? WHERE key = ?",
+                                   [(when, key) for key, when in accessed.items()])
+            self._conn.commit()
+        except sqlite3.OperationalError:
+            # Access times are a hint for eviction; losing a batch only makes LRU less exact
+            self._conn.rollback()
+
+    def _evict(self):
+        """Drops expired entries, then LRU entries until under the size limits. Caller holds the lock."""
+        if self._accessed:
+            self._flush_accessed()
+        cur = self._conn.execute("DELETE FROM llm_cache WHERE created < ?", (time.time() - self.ttl_seconds,))
+        self.stats["evictions"] += cur.rowcount
+
+        count, total_bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(outputs)), 0) FROM llm_cache"
+        ).fetchone()
+        if count > self.max_entries or total_bytes > self.max_bytes:
+            # Trim to 90% of the limits so eviction does not run on every put
+            keep = int(min(self.max_entries, count * self.max_bytes / max(total_bytes, 1)) * 0.9)
+            cur = self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "SELECT key FROM llm_cache ORDER BY last_access ASC LIMIT ?)",
+                (count - keep,)
+            )
+            self.stats["evictions"] += cur.rowcount
+        self._conn.commit()
+
+    def hit_rate(self) -> float:
+        total = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / total if total else 0.0
+
+    def close(self):
+        with self._lock:
+            if self._accessed:
+                self._flush_accessed()
+            self._conn.close()
+
+class CachedModule:
+    """Wraps a DSPy module so identical calls are answered from an LLMCache.
+
+    The key covers the module name, its input fields, its loaded demos and the active
+    LM configuration. With cache=None every call goes straight to the module.
+    """
+
+    def __init__(self, name: str, module: dspy.Module, cache: Optional[LLMCache]):
+        self.name = name
+        self.module = module
+        self.cache = cache
+        self.demos = demos_fingerprint(module) if cache is not None else ""
+
+    def __call__(self, **inputs) -> dspy.Prediction:
+        if self.cache is None:
+            pred = self.module(**inputs)
+            _record_usage(pred, inputs)
+            return pred
+
+        key = LLMCache.make_key(self.name, inputs, self.demos, lm_fingerprint())
+        outputs = self.cache.get(key)
+        if outputs is not None:
+            record(llm_cache_hits=1)
+            return dspy.Prediction(**outputs)
+
+        pred = self.module(**inputs)
+        _record_usage(pred, inputs)
+        self.cache.put(key, self.name, dict(pred.items()))
+        return pred
@@ -0,0 +1,129 @@
+import re
+from typing import List, Tuple
+
+HEADER_RE = re.compile(r"^(#{1,6})\s+\S")
+TABLE_SEPARATOR_RE = re.compile(r"^\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$")
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+def count_tokens(text: str) -> int:
+    """Approximates the LLM token count as words plus punctuation marks."""
+    return len(TOKEN_RE.findall(text))
+
+def _split_words(line: str, budget: int) -> List[str]:
+    pieces, current, used = [], [], 0
+    for word in line.split():
+        size = count_tokens(word)
+        if current and used + size > budget:
+            pieces.append(" ".join(current))
+            current, used = [], 0
+        current.append(word)
+        used += size
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+def _blocks(lines: List[str]) -> List[Tuple[str, List[str]]]:
+    """Groups section lines into ("table", rows) and ("text", lines) blocks."""
+    blocks = []
+    for line in lines:
+        if not line.strip():
+            blocks.append(("blank", []))
+            continue
+        kind = "table" if line.lstrip().startswith("|") else "text"
+        if blocks and blocks[-1][0] == kind:
+            blocks[-1][1].append(line)
+        else:
+            blocks.append((kind, [line]))
+    return [(kind, block) for kind, block in blocks if kind != "blank"]
+
+def _units(lines: List[str], budget: int) -> List[str]:
+    """Splits a section body into units of at most budget tokens.
+
+    Paragraphs and tables are kept whole when they fit. Oversized tables are split
+    into row groups that each repeat the header row, oversized paragraphs are split
+    by line, and oversized lines by word.
+    """
+    units = []
+    for kind, block in _blocks(lines):
+        text = "\n".join(block)
+        if count_tokens(text) <= budget:
+            units.append(text)
+            continue
+
+        if kind == "table":
+            header = block[:2] if len(block) > 1 and TABLE_SEPARATOR_RE.match(block[1].strip()) else block[:1]
+            rows = block[len(header):]
+            header_tokens = count_tokens("\n".join(header))
+            group, used = [], header_tokens
+            for row in rows:
+                size = count_tokens(row)
+                if group and used + size > budget:
+                    units.append("\n".join(header + group))
+                    group, used = [], header_tokens
+                group.append(row)
+                used += size
+            if group:
+                units.append("\n".join(header + group))
+            continue
+
+        for line in block:
+            if count_tokens(line) <= budget:
+                units.append(line)
+            else:
+                units.extend(_split_words(line, budget))
+    return units
+
+def chunk_markdown(text: str, max_tokens: int = 256, overlap: int = 32) -> List[str]:
+    """Splits markdown into chunks that respect headed sections and tables.
+
+    Every chunk starts with the trail of headers above it, so a section split over
+    several chunks stays self-describing. Consecutive chunks of one section share up
+    to `overlap` tokens of trailing content.
+    """
+    sections = []
+    trail: List[Tuple[int, str]] = []
+    body: List[str] = []
+    for line in text.splitlines():
+        match = HEADER_RE.match(line)
+        if match:
+            if any(l.strip() for l in body):
+                sections.append((list(trail), body))
+            level = len(match.group(1))
+            trail = [h for h in trail if h[0] < level] + [(level, line.strip())]
+            body = []
+        else:
+            body.append(line)
+    if any(l.strip() for l in body):
+        sections.append((list(trail), body))
+
+    chunks = []
+    for section_trail, section_body in sections:
+        header = "\n".join(h for _, h in section_trail)
+        budget = max(max_tokens - count_tokens(header), max_tokens // 2)
+
+        windows: List[List[str]] = []
+        current: List[str] = []
+        used = 0
+        for unit in _units(section_body, budget):
+            size = count_tokens(unit)
+            if current and used + size > budget:
+                windows.append(current)
+                # Carry trailing units of the previous window as overlap
+                carried, carried_tokens = [], 0
+                for prev in reversed(current):
+                    prev_tokens = count_tokens(prev)
+                    if carried_tokens + prev_tokens > overlap:
+                        break
+                    carried.insert(0, prev)
+                    carried_tokens += prev_tokens
+                if carried_tokens + size > budget:
+                    carried, carried_tokens = [], 0
+                current, used = carried, carried_tokens
+            current.append(unit)
+            used += size
+        if current:
+            windows.append(current)
+
+        for window in windows:
+            chunks.append("\n".join(([header] if header else []) + window).strip())
+    return chunks
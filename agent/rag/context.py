@@ -0,0 +1,50 @@
+from typing import List, Dict, Any
+from agent.rag.chunking import count_tokens
+
+TRUNCATION_SUFFIX = " ..."
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """Cuts text at a word boundary so that it plus TRUNCATION_SUFFIX fits in max_tokens."""
+    budget = max_tokens - count_tokens(TRUNCATION_SUFFIX)
+    words, used = [], 0
+    for word in text.split():
+        size = count_tokens(word)
+        if used + size > budget:
+            break
+        words.append(word)
+        used += size
+    return " ".join(words) + TRUNCATION_SUFFIX
+
+def format_context(docs: List[Dict[str, Any]], max_tokens: int = 512, min_tail_tokens: int = 16) -> str:
+    """Packs retrieved chunks, best first, into a compact prompt block of at most max_tokens.
+
+    Each chunk is rendered as its ID on one line followed by its text; scores and
+    source paths are left out. A chunk that does not fit is truncated if at least
+    min_tail_tokens remain, otherwise packing stops.
+    """
+    parts = []
+    used = 0
+    for doc in docs:
+        label = f"[{doc['id']}]"
+        text = doc["content"]
+        label_tokens = count_tokens(label)
+        text_tokens = count_tokens(text)
+        if used + label_tokens + text_tokens > max_tokens:
+            remaining = max_tokens - used - label_tokens
+            if remaining < min_tail_tokens:
+                break
+            text = _truncate(text, remaining)
+            text_tokens = count_tokens(text)
+        parts.append(f"{label}\n{text}")
+        used += label_tokens + text_tokens
+    return "\n\n".join(parts)
+
+def context_stats(docs: List[Dict[str, Any]], context: str) -> Dict[str, int]:
+    """Compares the packed context with the previous str(docs) prompt rendering."""
+    raw_tokens = count_tokens(str(docs))
+    context_tokens = count_tokens(context)
+    return {
+        "raw_tokens": raw_tokens,
+        "context_tokens": context_tokens,
+        "saved_tokens": max(raw_tokens - context_tokens, 0)
+    }
@@ -1,61 +1,307 @@
 import os
-from typing import List, Dict, Any
-from rank_bm25 import BM25Okapi
+import math
+import json
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from typing import List, Dict, Any, Optional
+import numpy as np
 import glob
+from agent.rag.chunking import chunk_markdown
+
+def _file_sha1(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _atomic_write(path: str, write):
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+INDEX_VERSION = 2
+
+# Arrays persisted in the index directory; loaded with mmap so startup does not copy them
+INDEX_ARRAYS = ["doc_len", "post_offsets", "post_docs", "post_weights", "idf", "tokens", "token_offsets"]
 
 class Retriever:
-    def __init__(self, docs_dir: str):
+    """BM25 (Okapi) retrieval over an inverted index.
+
+    Each term maps to a postings list of (chunk index, precomputed BM25 term weight),
+    so a query only touches chunks that contain its terms. Scores and rankings match
+    rank_bm25.BM25Okapi with the same k1, b and epsilon.
+
+    With index_dir set, chunks and index arrays are saved to disk along with a
+    manifest of file paths, mtimes and hashes. Later startups memory-map the arrays
+    and only re-chunk files that were added or changed.
+    """
+
+    def __init__(
+        self,
+        docs_dir: str,
+        k1: float = 1.5,
+        b: float = 0.75,
+        epsilon: float = 0.25,
+        index_dir: Optional[str] = None,
+        chunk_max_tokens: int = 256,
+        chunk_overlap: int = 32
+    ):
         self.docs_dir = docs_dir
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.index_dir = index_dir
+        self.chunk_max_tokens = chunk_max_tokens
+        self.chunk_overlap = chunk_overlap
         self.chunks: List[Dict[str, Any]] = []
-        self.bm25 = None
+        self.index_stats = {"files_reused": 0, "files_indexed": 0, "files_removed": 0, "loaded_from_disk": False}
+        # {query: (k, top-k chunks)} filled by prefetch(), bounded LRU
+        self._prefetched: "OrderedDict[str, Any]" = OrderedDict()
+        self._prefetch_lock = threading.Lock()
+        self.max_prefetched = 4096
         self._load_documents()
 
+    def _chunk_file(self, file_path: str) -> List[Dict[str, Any]]:
+        filename = os.path.basename(file_path)
+        with open(file_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+
+        # Header- and table-aware chunks within a token window
+        sections = chunk_markdown(content, self.chunk_max_tokens, self.chunk_overlap)
+
+        chunks = []
+        for j, text in enumerate(sections):
+            chunk_id = f"{filename.replace('.md', '')}::chunk{j}"
+            chunks.append({
+                "id": chunk_id,
+                "content": text,
+                "source": filename
+            })
+        return chunks
+
+    def _index_params(self) -> Dict[str, Any]:
+        return {
+            "version": INDEX_VERSION,
+            "k1": self.k1,
+            "b": self.b,
+            "epsilon": self.epsilon,
+            "chunk_max_tokens": self.chunk_max_tokens,
+            "chunk_overlap": self.chunk_overlap
+        }
+
     def _load_documents(self):
-        """Loads and chunks documents from the docs directory."""
-        file_paths = glob.glob(os.path.join(self.docs_dir, "*.md"))
-        
+        """Loads and chunks documents from the docs directory, reusing the on-disk index when possible."""
+        file_paths = sorted(glob.glob(os.path.join(self.docs_dir, "*.md")))
+        files = []
         for file_path in file_paths:
-            filename = os.path.basename(file_path)
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-                
-            # Simple chunking by sections (headers) or paragraphs
-            # For this assignment, splitting by double newlines is a reasonable start
-            # or splitting by headers if they exist.
-            # Let's try to split by '## ' to capture sections, or fall back to paragraphs.
-            
-            # Simple chunking by paragraphs
-            paragraphs = [p.strip() for p in content.split('\n\n') if p.strip()]
-            
-            for j, para in enumerate(paragraphs):
-                chunk_id = f"{filename.replace('.md', '')}::chunk{j}"
-                self.chunks.append({
-                    "id": chunk_id,
-                    "content": para,
-                    "source": filename
-                })
-
-        # Initialize BM25
-        tokenized_corpus = [chunk["content"].lower().split() for chunk in self.chunks]
-        self.bm25 = BM25Okapi(tokenized_corpus)
+            st = os.stat(file_path)
+            files.append({"path": os.path.relpath(file_path, self.docs_dir), "mtime_ns": st.st_mtime_ns, "size": st.st_size})
+
+        manifest = self._read_manifest()
+        old_files = {f["path"]: f for f in manifest["files"]} if manifest else {}
+        old_chunks = None
+
+        # Per file: its token lists, or the (start, count) chunk range of a reused file,
+        # whose tokens are only decoded if the index has to be rebuilt
+        corpus = []
+        dirty = manifest is None or len(old_files) != len(files)
+        for entry in files:
+            file_path = os.path.join(self.docs_dir, entry["path"])
+            old = old_files.get(entry["path"])
+            if old is not None and (old["mtime_ns"], old["size"]) != (entry["mtime_ns"], entry["size"]):
+                # Touched but possibly unchanged: compare content hashes before re-chunking
+                entry["sha1"] = _file_sha1(file_path)
+                if entry["sha1"] != old["sha1"]:
+                    old = None
+                dirty = True
+            if old is None:
+                chunks = self._chunk_file(file_path)
+                entry["sha1"] = entry.get("sha1") or _file_sha1(file_path)
+                tokens = [self.tokenize(chunk["content"]) for chunk in chunks]
+                self.index_stats["files_indexed"] += 1
+                dirty = True
+            else:
+                if old_chunks is None:
+                    old_chunks = self._read_chunks()
+                start, count = old["chunk_start"], old["num_chunks"]
+                chunks = old_chunks[start:start + count]
+                tokens = (start, count)
+                entry["sha1"] = old["sha1"]
+                self.index_stats["files_reused"] += 1
+            entry["chunk_start"] = len(self.chunks)
+            entry["num_chunks"] = len(chunks)
+            self.chunks.extend(chunks)
+            corpus.append(tokens)
+        self.index_stats["files_removed"] = len(set(old_files) - {f["path"] for f in files})
+
+        if not dirty:
+            self._load_index_arrays(manifest)
+            return
+
+        tokenized_corpus = []
+        for tokens in corpus:
+            if isinstance(tokens, tuple):
+                tokens = self._read_tokens(manifest, *tokens)
+            tokenized_corpus.extend(tokens)
+        self._build_index(tokenized_corpus)
+        if self.index_dir:
+            self._save_index(files, tokenized_corpus)
+
+    def _read_manifest(self) -> Optional[Dict[str, Any]]:
+        if not self.index_dir:
+            return None
+        try:
+            with open(os.path.join(self.index_dir, "manifest.json"), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get("params") != self._index_params():
+            return None
+        return manifest
+
+    def _read_chunks(self) -> List[Dict[str, Any]]:
+        with open(os.path.join(self.index_dir, "chunks.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _read_tokens(self, manifest: Dict[str, Any], start: int, count: int) -> List[List[str]]:
+        """Returns the token lists of stored chunks start..start + count (decoded from term ids)."""
+        vocab = manifest["vocab"]
+        tokens = np.load(os.path.join(self.index_dir, "tokens.npy"), mmap_mode="r")
+        offsets = np.load(os.path.join(self.index_dir, "token_offsets.npy"), mmap_mode="r")
+        return [
+            [vocab[t] for t in tokens[offsets[i]:offsets[i + 1]].tolist()]
+            for i in range(start, start + count)
+        ]
+
+    def _load_index_arrays(self, manifest: Dict[str, Any]):
+        self.vocab = {term: i for i, term in enumerate(manifest["vocab"])}
+        for name in ["doc_len", "post_offsets", "post_docs", "post_weights", "idf"]:
+            setattr(self, name, np.load(os.path.join(self.index_dir, f"{name}.npy"), mmap_mode="r"))
+        self.index_stats["loaded_from_disk"] = True
+
+    def _save_index(self, files: List[Dict[str, Any]], tokenized_corpus: List[List[str]]):
+        os.makedirs(self.index_dir, exist_ok=True)
+        lengths = [len(tokens) for tokens in tokenized_corpus]
+        arrays = {
+            "doc_len": self.doc_len,
+            "post_offsets": self.post_offsets,
+            "post_docs": self.post_docs,
+            "post_weights": self.post_weights,
+            "idf": self.idf,
+            "tokens": np.array([self.vocab[t] for tokens in tokenized_corpus for t in tokens], dtype=np.int64),
+            "token_offsets": np.concatenate(([0], np.cumsum(lengths))).astype(np.int64),
+        }
+        # Write each file under a temp name and rename it into place; the manifest goes
+        # last so an interrupted save is simply rebuilt on the next start.
+        for name in INDEX_ARRAYS:
+            _atomic_write(os.path.join(self.index_dir, f"{name}.npy"), lambda f, a=arrays[name]: np.save(f, a))
+        _atomic_write(
+            os.path.join(self.index_dir, "chunks.json"),
+            lambda f: f.write(json.dumps(self.chunks).encode("utf-8"))
+        )
+        vocab = [None] * len(self.vocab)
+        for term, term_id in self.vocab.items():
+            vocab[term_id] = term
+        manifest = {"params": self._index_params(), "files": files, "vocab": vocab}
+        _atomic_write(
+            os.path.join(self.index_dir, "manifest.json"),
+            lambda f: f.write(json.dumps(manifest).encode("utf-8"))
+        )
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return text.lower().split()
+
+    def _build_index(self, tokenized_corpus: List[List[str]]):
+        """Builds term -> postings arrays with precomputed IDF and doc-length norms."""
+        self.vocab: Dict[str, int] = {}
+        term_ids, doc_ids, tfs = [], [], []
+        for doc_id, tokens in enumerate(tokenized_corpus):
+            for term, tf in Counter(tokens).items():
+                term_ids.append(self.vocab.setdefault(term, len(self.vocab)))
+                doc_ids.append(doc_id)
+                tfs.append(tf)
+
+        num_docs = len(tokenized_corpus)
+        self.doc_len = np.array([len(tokens) for tokens in tokenized_corpus], dtype=np.float64)
+        avgdl = float(self.doc_len.sum()) / num_docs if num_docs else 1.0
+
+        term_ids = np.array(term_ids, dtype=np.int64)
+        doc_ids = np.array(doc_ids, dtype=np.int64)
+        tfs = np.array(tfs, dtype=np.float64)
+
+        # Group postings by term; stable sort keeps chunk order within a term
+        order = np.argsort(term_ids, kind="stable")
+        self.post_docs = doc_ids[order]
+        tf = tfs[order]
+        doc_freq = np.bincount(term_ids, minlength=len(self.vocab))
+        self.post_offsets = np.concatenate(([0], np.cumsum(doc_freq))).astype(np.int64)
+
+        # BM25 term weight without IDF, evaluated in the same order as BM25Okapi.get_scores
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len[self.post_docs] / avgdl)
+        self.post_weights = tf * (self.k1 + 1) / (tf + norm)
+
+        # IDF with BM25Okapi's epsilon floor for very common terms
+        idf = [math.log(num_docs - df + 0.5) - math.log(df + 0.5) for df in doc_freq.tolist()]
+        if idf:
+            eps = self.epsilon * (sum(idf) / len(idf))
+            idf = [eps if value < 0 else value for value in idf]
+        self.idf = np.array(idf, dtype=np.float64)
+
+    def _score(self, tokenized_query: List[str], out: np.ndarray):
+        for term in tokenized_query:
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.post_offsets[term_id], self.post_offsets[term_id + 1]
+            out[self.post_docs[start:end]] += self.idf[term_id] * self.post_weights[start:end]
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        """Indices of the k best scores, ties broken by chunk order (like a stable sort)."""
+        if k < len(scores):
+            threshold = scores[np.argpartition(-scores, k - 1)[:k]].min()
+            candidates = np.nonzero(scores >= threshold)[0]
+        else:
+            candidates = np.arange(len(scores))
+        return candidates[np.lexsort((candidates, -scores[candidates]))][:k]
+
+    def retrieve_many(self, queries: List[str], k: int = 3) -> List[List[Dict[str, Any]]]:
+        """Retrieves top-k chunks for each query in one pass over a shared score matrix."""
+        if not self.chunks or k <= 0:
+            return [[] for _ in queries]
+
+        scores = np.zeros((len(queries), len(self.chunks)), dtype=np.float64)
+        for row, query in enumerate(queries):
+            self._score(self.tokenize(query), scores[row])
 
-    def retrieve(self, query: str, k: int = 3) -> List[Dict[str, Any]]:
-        """Retrieves top-k chunks for a given query."""
-        if not self.chunks:
-            return []
-            
-        tokenized_query = query.lower().split()
-        scores = self.bm25.get_scores(tokenized_query)
-        
-        # Get top-k indices
-        top_n = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:k]
-        
         results = []
-        for i in top_n:
-            # Filter out very low scores if needed, but for now return top k
-            results.append({
-                **self.chunks[i],
-                "score": float(scores[i])
-            })
-            
+        for row in scores:
+            results.append([
+                {**self.chunks[i], "score": float(row[i])}
+                for i in self._top_k(row, k)
+            ])
         return results
+
+    def prefetch(self, queries: List[str], k: int = 3):
+        """Scores a micro-batch of queries in one retrieve_many pass and keeps their
+        top-k, so later retrieve() calls for the same queries (with k or fewer) are lookups."""
+        results = self.retrieve_many(queries, k)
+        with self._prefetch_lock:
+            for query, docs in zip(queries, results):
+                self._prefetched[query] = (k, docs)
+                self._prefetched.move_to_end(query)
+            while len(self._prefetched) > self.max_prefetched:
+                self._prefetched.popitem(last=False)
+
+    def retrieve(self, query: str, k: int = 3) -> List[Dict[str, Any]]:
+        """Retrieves top-k chunks for a given query."""
+        if self._prefetched:
+            with self._prefetch_lock:
+                hit = self._prefetched.get(query)
+            if hit is not None and hit[0] >= k:
+                return [dict(doc) for doc in hit[1][:k]]
+        return self.retrieve_many([query], k)[0]
@@ -0,0 +1,376 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from agent.answer_mapping import parse_format_hint
+
+ROLLUP_VERSION = 1
+# Gross margin uses CostOfGoods approximated as 70% of UnitPrice, the approximation
+# the evaluation questions ask for when cost is not in the database
+COST_RATIO = 0.7
+
+CALENDAR_RE = re.compile(r"^##\s+(.+?)\s*\n-\s*Dates:\s*(\d{4}-\d{2}-\d{2})\s+to\s+(\d{4}-\d{2}-\d{2})", re.M)
+KPI_HEADING_RE = re.compile(r"^##\s+(.+)$", re.M)
+
+# Rollup tables and their grouping column (None for the per-window totals)
+TABLES = {"window_totals": None, "window_category": "category", "window_product": "product", "window_customer": "customer"}
+DIMENSION_SQL = {"category": "c.CategoryName", "product": "p.ProductName", "customer": "cu.CompanyName"}
+MEASURES = {"revenue": "REAL", "quantity": "INTEGER", "orders": "INTEGER", "aov": "REAL", "gross_margin": "REAL"}
+
+REVENUE = 'od.UnitPrice * od.Quantity * (1 - od.Discount)'
+MEASURES_SQL = (
+    f"SUM({REVENUE}), SUM(od.Quantity), COUNT(DISTINCT o.OrderID), "
+    f"SUM({REVENUE}) / COUNT(DISTINCT o.OrderID), "
+    f"SUM((od.UnitPrice - {COST_RATIO} * od.UnitPrice) * od.Quantity * (1 - od.Discount))"
+)
+SOURCE_SQL = (
+    'FROM src.Orders o JOIN src."Order Details" od ON od.OrderID = o.OrderID '
+    'JOIN src.Products p ON p.ProductID = od.ProductID '
+    'LEFT JOIN src.Categories c ON c.CategoryID = p.CategoryID '
+    'LEFT JOIN src.Customers cu ON cu.CustomerID = o.CustomerID'
+)
+
+def parse_calendar(text: str) -> List[Tuple[str, str, str]]:
+    """Returns (name, start, end) for every '## Name' section with a '- Dates: A to B' line."""
+    return [(name, start, end) for name, start, end in CALENDAR_RE.findall(text)]
+
+def read_calendar(docs_dir: str) -> List[Tuple[str, str, str]]:
+    """parse_calendar() over docs_dir/marketing_calendar.md; empty when the doc is missing."""
+    path = os.path.join(docs_dir, "marketing_calendar.md")
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return parse_calendar(f.read())
+
+def parse_kpis(text: str) -> List[str]:
+    """Returns the rollup measures backed by a definition in the KPI doc."""
+    kpis = []
+    for heading in KPI_HEADING_RE.findall(text):
+        heading = heading.lower()
+        if "average order value" in heading or "aov" in heading:
+            kpis.append("aov")
+        elif "margin" in heading:
+            kpis.append("gross_margin")
+    return kpis
+
+class KPIRollups:
+    """Precomputed KPI aggregates per date window, kept in a sidecar SQLite file.
+
+    Windows are the marketing-calendar campaigns, every calendar year in Orders and
+    'all' (all-time). For each window the sidecar holds revenue, quantity, orders, AOV
+    and gross margin overall and per category, product and customer. refresh() only
+    rebuilds windows whose source rows changed, and skips all work while the source
+    database file is unchanged. The agent attaches the sidecar read-only as "kpi".
+    """
+
+    def __init__(self, db_path: str, docs_dir: str, path: str):
+        self.db_path = db_path
+        self.docs_dir = docs_dir
+        self.path = path
+        self.windows: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+        self.categories: List[str] = []
+        self.kpis: List[str] = []
+        self.stats = {"windows": 0, "rebuilt": 0, "reused": 0, "refreshes": 0}
+        self._stat_key = None
+        self._lock = threading.Lock()
+
+    def _read_doc(self, name: str) -> str:
+        path = os.path.join(self.docs_dir, name)
+        if not os.path.exists(path):
+            return ""
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+
+    def _source_key(self) -> str:
+        st = os.stat(self.db_path)
+        calendar = self._read_doc("marketing_calendar.md") + self._read_doc("kpi_definitions.md")
+        return json.dumps([ROLLUP_VERSION, COST_RATIO, st.st_mtime_ns, st.st_size,
+                           hashlib.sha1(calendar.encode("utf-8")).hexdigest()])
+
+    def is_stale(self) -> bool:
+        try:
+            return self._source_key() != self._stat_key
+        except OSError:
+            return False
+
+    def refresh(self) -> Dict[str, int]:
+        """Brings the sidecar up to date with the source database and the docs."""
+        with self._lock:
+            key = self._source_key()
+            conn = sqlite3.connect(self.path)
+            try:
+                self._refresh(conn, key)
+            finally:
+                conn.close()
+            self._stat_key = key
+        return self.stats
+
+    def _refresh(self, conn: sqlite3.Connection, key: str):
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("CREATE TABLE IF NOT EXISTS windows (window_name TEXT PRIMARY KEY, start TEXT, end TEXT, signature TEXT)")
+        measures = ", ".join(f"{m} {t}" for m, t in MEASURES.items())
+        for table, dimension in TABLES.items():
+            columns = "window_name TEXT, " + (f"{dimension} TEXT, " if dimension else "")
+            if dimension == "product":
+                columns += "category TEXT, "
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns}{measures})")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table} ON {table} "
+                         f"(window_name{', ' + dimension if dimension else ''})")
+
+        stored = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+        if stored.get("source_key") == key:
+            self._load_windows(conn)
+            self.stats["reused"] = len(self.windows)
+            self.stats["rebuilt"] = 0
+            return
+
+        conn.execute("ATTACH DATABASE ? AS src", (Path(self.db_path).resolve().as_uri() + "?mode=ro",))
+        # Renamed products, categories or customers invalidate every window
+        dimensions = hashlib.sha1(json.dumps([
+            conn.execute("SELECT ProductID, ProductName, CategoryID FROM src.Products ORDER BY ProductID").fetchall(),
+            conn.execute("SELECT CategoryID, CategoryName FROM src.Categories ORDER BY CategoryID").fetchall(),
+            conn.execute("SELECT CustomerID, CompanyName FROM src.Customers ORDER BY CustomerID").fetchall()
+        ], default=str).encode("utf-8")).hexdigest()
+
+        windows = {name: (start, end) for name, start, end in parse_calendar(self._read_doc("marketing_calendar.md"))}
+        for (year,) in conn.execute("SELECT DISTINCT substr(OrderDate, 1, 4) FROM src.Orders WHERE OrderDate IS NOT NULL"):
+            windows.setdefault(year, (f"{year}-01-01", f"{year}-12-31"))
+        windows["all"] = (None, None)
+
+        previous = {row[0]: row[1] for row in conn.execute("SELECT window_name, signature FROM windows")}
+        rebuilt = 0
+        with conn:
+            for name in set(previous) - set(windows):
+                self._delete_window(conn, name)
+            for name, (start, end) in windows.items():
+                where, params = self._window_filter(start, end)
+                # Cheap fact fingerprint: changes whenever a row inside the window changes
+                facts = conn.execute(
+                    f"SELECT COUNT(*), TOTAL({REVENUE}), TOTAL(od.Quantity), TOTAL(od.ProductID), TOTAL(o.OrderID) "
+                    f'FROM src.Orders o JOIN src."Order Details" od ON od.OrderID = o.OrderID WHERE {where}',
+                    params
+                ).fetchone()
+                signature = hashlib.sha1(json.dumps([start, end, dimensions, facts]).encode("utf-8")).hexdigest()
+                if previous.get(name) == signature:
+                    continue
+                self._delete_window(conn, name)
+                self._build_window(conn, name, where, params)
+                conn.execute("INSERT INTO windows VALUES (?, ?, ?, ?)", (name, start, end, signature))
+                rebuilt += 1
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('source_key', ?)", (key,))
+        conn.execute("DETACH DATABASE src")
+
+        self._load_windows(conn)
+        self.stats["rebuilt"] = rebuilt
+        self.stats["reused"] = len(windows) - rebuilt
+        self.stats["refreshes"] += 1
+
+    @staticmethod
+    def _window_filter(start: Optional[str], end: Optional[str]):
+        if start is None:
+            return "1 = 1", ()
+        return "o.OrderDate >= ? AND o.OrderDate < date(?, '+1 day')", (start, end)
+
+    @staticmethod
+    def _delete_window(conn: sqlite3.Connection, name: str):
+        conn.execute("DELETE FROM windows WHERE window_name = ?", (name,))
+        for table in TABLES:
+            conn.execute(f"DELETE FROM {table} WHERE window_name = ?", (name,))
+
+    @staticmethod
+    def _build_window(conn: sqlite3.Connection, name: str, where: str, params: Tuple):
+        for table, dimension in TABLES.items():
+            group = [DIMENSION_SQL[dimension]] if dimension else []
+            if dimension == "product":
+                group.append("c.CategoryName")
+            select = ", ".join(["?"] + group + [MEASURES_SQL])
+            group_by = f" GROUP BY {', '.join(group)}" if group else ""
+            conn.execute(
+                f"INSERT INTO {table} SELECT {select} {SOURCE_SQL} WHERE {where}{group_by}"
+                + ("" if group else " HAVING COUNT(*) > 0"),
+                (name,) + params
+            )
+
+    def _load_windows(self, conn: sqlite3.Connection):
+        self.windows = {row[0]: (row[1], row[2]) for row in conn.execute("SELECT window_name, start, end FROM windows")}
+        self.categories = [row[0] for row in conn.execute(
+            "SELECT DISTINCT category FROM window_category WHERE category IS NOT NULL")]
+        self.kpis = ["revenue", "quantity", "orders"] + parse_kpis(self._read_doc("kpi_definitions.md"))
+        self.stats["windows"] = len(self.windows)
+
+    def describe(self, question: str) -> str:
+        """Schema lines for the rollups, added to the SQL prompt when the question names a window."""
+        if not any(name.lower() in question.lower() for name in self.windows if not name.isdigit() and name != "all"):
+            return ""
+        measures = ", ".join(MEASURES)
+        lines = ["Precomputed KPI rollups (attached database kpi, one row per window_name and group):"]
+        for table, dimension in TABLES.items():
+            group = f"{dimension}, " if dimension else ""
+            if dimension == "product":
+                group += "category, "
+            lines.append(f"Table: kpi.{table}(window_name, {group}{measures})")
+        names = ", ".join(f"'{name}'" for name in self.windows)
+        lines.append(f"  window_name is one of {names}; gross_margin assumes cost = {COST_RATIO:g} * UnitPrice")
+        return "\n".join(lines) + "\n"
+
+    def match(self, question: str, format_hint: str) -> Optional[str]:
+        """Returns SQL over the rollups when the question is an unambiguous KPI lookup, else None."""
+        return match_rollup(question, format_hint, self.windows, self.categories, self.kpis)
+
+def rollup_sources(sql: str) -> List[str]:
+    """Returns the source tables behind the rollups a query reads, for citations."""
+    lowered = (sql or "").lower()
+    if "kpi." not in lowered:
+        return []
+    tables = ["Orders", "Order Details", "Products"]
+    if "category" in lowered:
+        tables.append("Categories")
+    if "kpi.window_customer" in lowered:
+        tables.append("Customers")
+    return tables
+
+KPI_PATTERNS = [
+    ("aov", re.compile(r"\baov\b|average order value", re.I)),
+    ("gross_margin", re.compile(r"\bmargin\b", re.I)),
+    ("revenue", re.compile(r"\brevenue\b|\bsales\b", re.I)),
+    ("quantity", re.compile(r"\bquantity\b|\bunits\b", re.I)),
+    ("orders", re.compile(r"\b(?:how many|number of|count of)\s+(?:\w+\s+)?orders\b|\border count\b", re.I)),
+]
+# Counting questions only fit the count measures
+COUNT_RE = re.compile(r"\bhow many\b|\bnumber of\b|\bcount of\b", re.I)
+FIELD_COLUMNS = {
+    "revenue": "revenue", "sales": "revenue", "quantity": "quantity", "units": "quantity",
+    "orders": "orders", "aov": "aov", "margin": "gross_margin", "gross_margin": "gross_margin",
+    "category": "category", "product": "product", "customer": "customer"
+}
+RANK_RE = re.compile(r"\b(top|highest|most|best|largest)\b", re.I)
+TOP_N_RE = re.compile(r"\btop\s+(\d+)\b", re.I)
+YEAR_RE = re.compile(r"\b(19\d\d|20\d\d)\b")
+ALL_TIME_RE = re.compile(r"\ball[- ]time\b|\boverall\b", re.I)
+# Inline formulas such as SUM(UnitPrice*Quantity*(1-Discount)), one level of nesting
+FORMULA_RE = re.compile(r"[\w.]*\([^()]*(?:\([^()]*\)[^()]*)*\)")
+# The cost-assumption clause, e.g. "Assume CostOfGoods is approximated by 70% of UnitPrice if not available."
+COST_ASSUMPTION_RE = re.compile(
+    r"\b(?:assum\w*|approximat\w*)\b[^.?!]*?(?:\b70\s*%|\b0?\.7\b)"
+    r"(?:\s*(?:of|\*|x)\s*(?:the\s+)?unit\s*price)?(?:\s*,?\s*if\s+(?:it\s+is\s+)?not\s+available)?\s*\.?",
+    re.I
+)
+# Anything the rollups cannot express sends the question down the normal SQL path
+UNSUPPORTED_RE = re.compile(
+    r"\b(month\w*|week\w*|quarter\w*|daily|share|percent\w*|growth|compar\w*|versus|vs|difference|ratio|"
+    r"employee\w*|countr\w*|ship\w*|freight|supplier\w*|discontinued|median|between|exclud\w*|except|"
+    r"lowest|least|worst|bottom|fewest)\b|%|average (?!order value)",
+    re.I
+)
+# Once the window, category and formulas are removed every remaining word must be one
+# of these; any other word (a product name, "discount", "before", ...) is a filter the
+# rollups do not carry, so the question goes down the normal SQL path
+ALLOWED_WORDS = frozenset((
+    # windows
+    "during in for of from the all time overall year dates date window period campaign marketing calendar defined "
+    # KPIs
+    "revenue sales quantity units orders order details aov average value gross margin kpi kpis definition docs "
+    "uses using use per according "
+    # dimensions and ranking
+    "category categories product products customer customers top highest most best largest by "
+    # answer format and filler
+    "return a an float int integer str list rounded round to decimals decimal places what which who was were is "
+    "had has have did how much many number count there placed total sold as"
+).split())
+WORD_RE = re.compile(r"[a-z]+")
+
+def _quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+def match_rollup(question: str, format_hint: str, windows, categories: List[str], kpis: List[str]) -> Optional[str]:
+    spec = parse_format_hint(format_hint)
+    if spec is None:
+        return None
+
+    # Window: a quoted calendar name, else a single year, else all-time
+    quoted = re.findall(r"'([^']+)'", question)
+    by_name = {name.lower(): name for name in windows}
+    named = [by_name[q.lower()] for q in quoted if q.lower() in by_name and not q.isdigit()]
+    rest = FORMULA_RE.sub(" ", question)
+    for name in named:
+        rest = re.sub(re.escape(name), " ", rest, flags=re.I)
+    years = set(YEAR_RE.findall(rest))
+    if len(named) == 1 and not years:
+        window = named[0]
+    elif not named and len(years) == 1 and years <= set(windows):
+        window = years.pop()
+    elif not named and not years and ALL_TIME_RE.search(rest):
+        window = "all"
+    else:
+        return None
+
+    if COST_ASSUMPTION_RE.search(rest):
+        rest = COST_ASSUMPTION_RE.sub(" ", rest)
+        cost_assumed = True
+    else:
+        cost_assumed = False
+    if UNSUPPORTED_RE.search(rest):
+        return None
+
+    matched_kpis = [kpi for kpi, pattern in KPI_PATTERNS if pattern.search(rest) and kpi in kpis]
+    if len(matched_kpis) != 1:
+        return None
+    kpi = matched_kpis[0]
+    if COUNT_RE.search(rest) and kpi not in ("orders", "quantity"):
+        return None
+    # Margins only match the documented cost approximation the rollups were built with
+    if kpi == "gross_margin" and not cost_assumed:
+        return None
+
+    lowered = rest.lower()
+    dimension = next((d for d in ("category", "product", "customer") if re.search(rf"\b{d}", lowered)), None)
+    category_filter = [c for c in categories if re.search(r"(?<!\w)" + re.escape(c) + r"(?!\w)", rest)]
+    if len(category_filter) > 1:
+        return None
+    category = category_filter[0] if category_filter else None
+    words = WORD_RE.findall((rest.replace(category, " ") if category else rest).lower())
+    if any(word not in ALLOWED_WORDS for word in words):
+        return None
+    ranked = bool(RANK_RE.search(rest))
+
+    if dimension is None or (category and dimension == "category" and not ranked):
+        table = "window_category" if category else "window_totals"
+        group = "category" if category else None
+    else:
+        table, group = f"window_{dimension}", dimension
+    if category and table not in ("window_category", "window_product"):
+        return None
+
+    # Output columns, named after the format hint's fields
+    if spec.fields:
+        columns = []
+        for field, _ in spec.fields:
+            column = FIELD_COLUMNS.get(field.lower())
+            if column is None or (column in TABLES.values() and column != group and not
+                                  (column == "category" and table == "window_product")):
+                return None
+            columns.append(f"{column} AS {field}")
+    elif spec.scalar_type == "str":
+        if group is None:
+            return None
+        columns = [group]
+    else:
+        columns = [kpi]
+
+    where = [f"window_name = {_quote(window)}"]
+    if category:
+        where.append(f"category = {_quote(category)}")
+    sql = f"SELECT {', '.join(columns)} FROM kpi.{table} WHERE {' AND '.join(where)}"
+    if ranked or spec.kind == "list":
+        sql += f" ORDER BY {kpi} DESC"
+    if ranked:
+        top_n = TOP_N_RE.search(rest)
+        limit = int(top_n.group(1)) if top_n else 1
+        sql += f" LIMIT {limit}"
+    if spec.kind != "list" and not ranked and group is not None and not category:
+        return None
+    return sql
@@ -0,0 +1,267 @@
+import re
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from agent.fast_router import _singular
+from agent.rag.chunking import count_tokens
+
+# Domain words that do not name a table or column but imply one
+SYNONYMS = {
+    "revenue": ["Order Details"],
+    "sales": ["Order Details"],
+    "sold": ["Order Details"],
+    "quantity": ["Order Details"],
+    "discount": ["Order Details"],
+    "margin": ["Order Details"],
+    "aov": ["Orders", "Order Details"],
+    "date": ["Orders"],
+    "year": ["Orders"],
+    "dates": ["Orders"],
+    "campaign": ["Orders"],
+    "category": ["Categories"],
+    "product": ["Products"],
+    "customer": ["Customers"],
+    "supplier": ["Suppliers"],
+    "employee": ["Employees"],
+    "shipper": ["Shippers"],
+}
+
+# Tables whose dates a date window filters on; always linked when the question or
+# plan has a year, an ISO date or a calendar window name
+DATE_TABLES = ["Orders"]
+YEAR_RE = re.compile(r"\b(?:19|20)\d\d\b")
+
+# Name columns whose values link a question to their table ("Chai" -> Products)
+VALUE_COLUMNS = {"Products": "ProductName", "Categories": "CategoryName", "Customers": "CompanyName"}
+
+# Below this best score nothing was linked with confidence and the full schema is sent
+MIN_LINK_SCORE = 1.0
+
+# Column-name parts too generic to link on their own
+STOPWORDS = {"id", "name", "the", "of", "and", "a", "to", "in", "by", "for", "per", "is", "what", "which", "return"}
+
+def _split_identifier(name: str) -> List[str]:
+    """'UnitPrice' -> ['unit', 'price'], 'Order Details' -> ['order', 'details']."""
+    words = re.findall(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+", name)
+    return [w.lower() for w in words]
+
+def _stem(word: str) -> str:
+    """Crude suffix stemming on top of _singular: 'ordered' and 'ordering' -> 'order', 'shipped' -> 'ship'."""
+    for suffix in ("ing", "ed"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)]
+            if len(word) > 3 and word[-1] == word[-2] and word[-1] not in "ls":
+                word = word[:-1]
+            break
+    return _singular(word)
+
+class SchemaLinker:
+    """Selects the minimal subschema relevant to a question and plan.
+
+    Tables are scored by matches between question/plan words and table names, column
+    names and domain synonyms. The selected tables are then connected through the
+    foreign-key graph (declared FKs, or shared key columns when none are declared) so
+    join tables such as "Order Details" are included. Names from values (e.g. product
+    names) link their table, questions with a date window (a year, a date or one of
+    window_names) always get the DATE_TABLES and their date columns, and questions
+    where nothing links confidently get every table.
+    """
+
+    def __init__(
+        self,
+        table_columns: Dict[str, List[Tuple[str, str]]],
+        foreign_keys: List[Tuple[str, str, str, Optional[str]]],
+        full_schema: Optional[str] = None,
+        max_columns: int = 12,
+        window_names: Iterable[str] = (),
+        values: Optional[Dict[str, Iterable[str]]] = None
+    ):
+        self.table_columns = {t: cols for t, cols in table_columns.items() if not t.startswith("sqlite_")}
+        self.max_columns = max_columns
+        self.window_names = [name.lower() for name in window_names]
+
+        # Lowercased VALUE_COLUMNS values -> their tables, matched as whole phrases
+        self.value_tables: Dict[str, Set[str]] = {}
+        for table, table_values in (values or {}).items():
+            if table not in self.table_columns:
+                continue
+            for value in table_values:
+                if isinstance(value, str) and len(value.strip()) >= 3:
+                    self.value_tables.setdefault(value.strip().lower(), set()).add(table)
+        self.value_re = re.compile(
+            r"(?<!\w)(" + "|".join(map(re.escape, sorted(self.value_tables, key=len, reverse=True))) + r")(?!\w)"
+        ) if self.value_tables else None
+
+        # word -> {table: weight}; table-name words weigh more than column-name words
+        self.index: Dict[str, Dict[str, float]] = {}
+        # Weights are split across the words of an identifier, so "Customers" outranks
+        # "CustomerCustomerDemo" for "customer"
+        for table, columns in self.table_columns.items():
+            words = _split_identifier(table)
+            for word in words:
+                self._add(_stem(word), table, 2.0 / len(words))
+            for name, _ in columns:
+                words = _split_identifier(name)
+                for word in words:
+                    self._add(_stem(word), table, 1.0 / len(words))
+        for word, tables in SYNONYMS.items():
+            for table in tables:
+                if table in self.table_columns:
+                    self._add(_stem(word), table, 1.5)
+
+        self.table_phrases = {
+            table: " ".join(_stem(w) for w in _split_identifier(table)) for table in self.table_columns
+        }
+
+        # Undirected join graph for path finding, and per-table FK columns for rendering
+        self.links: Dict[str, Set[str]] = {t: set() for t in self.table_columns}
+        self.references: Dict[str, Dict[str, Tuple[str, str]]] = {t: {} for t in self.table_columns}
+        for table, column, ref_table, ref_column in foreign_keys or self._infer_foreign_keys():
+            if table not in self.links or ref_table not in self.links:
+                continue
+            ref_column = ref_column or self.table_columns[ref_table][0][0]
+            self.links[table].add(ref_table)
+            self.links[ref_table].add(table)
+            self.references[table][column] = (ref_table, ref_column)
+
+        # Baseline for the token savings: what GenerateSQL received before pruning
+        self.full_schema = full_schema if full_schema is not None else self.render(list(self.table_columns))
+        self.full_tokens = count_tokens(self.full_schema)
+
+    def _add(self, word: str, table: str, weight: float):
+        if word in STOPWORDS:
+            return
+        tables = self.index.setdefault(word, {})
+        tables[table] = max(tables.get(table, 0.0), weight)
+
+    def _infer_foreign_keys(self) -> List[Tuple[str, str, str, str]]:
+        """Treats a table's leading *ID column as its key and any other table holding it as a reference.
+
+        When several tables lead with the same key column, the one named after it owns
+        it (OrderID belongs to Orders, not "Order Details").
+        """
+        keys = {}
+        for table, columns in self.table_columns.items():
+            if not columns or not columns[0][0].lower().endswith("id"):
+                continue
+            key = columns[0][0]
+            named_after = [_singular(w) for w in _split_identifier(key[:-2])] == \
+                [_singular(w) for w in _split_identifier(table)]
+            if key not in keys or named_after:
+                keys[key] = table
+        inferred = []
+        for table, columns in self.table_columns.items():
+            for name, _ in columns:
+                owner = keys.get(name)
+                if owner and owner != table:
+                    inferred.append((table, name, owner, name))
+        return inferred
+
+    def _score(self, text: str) -> Dict[str, float]:
+        scores: Dict[str, float] = {}
+        for word in re.findall(r"[a-z]+", text.lower()):
+            for table, weight in self.index.get(_stem(word), {}).items():
+                scores[table] = scores.get(table, 0.0) + weight
+        return scores
+
+    def value_links(self, text: str) -> Set[str]:
+        """Tables whose name values (a product, category or customer) appear in the text."""
+        if self.value_re is None:
+            return set()
+        return {t for value in self.value_re.findall(text.lower()) for t in self.value_tables[value]}
+
+    def has_date_window(self, text: str) -> bool:
+        lowered = text.lower()
+        return bool(YEAR_RE.search(text)) or any(name in lowered for name in self.window_names)
+
+    def _path(self, start: str, goal: str) -> List[str]:
+        parents = {start: None}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            if node == goal:
+                path = []
+                while node is not None:
+                    path.append(node)
+                    node = parents[node]
+                return path
+            for neighbour in sorted(self.links[node]):
+                if neighbour not in parents:
+                    parents[neighbour] = node
+                    queue.append(neighbour)
+        return []
+
+    def select_tables(self, question: str, plan: str = "") -> List[str]:
+        """Returns the relevant tables, connected through FK join paths."""
+        # Question words count twice as much as plan words
+        scores = self._score(question)
+        for table, score in self._score(plan).items():
+            scores[table] = scores.get(table, 0.0) + 0.5 * score
+        # Tables named outright or through one of their values are always kept;
+        # others must score above half the best
+        words = " ".join(_stem(w) for w in re.findall(r"[a-z]+", question.lower()))
+        named = {t for t, phrase in self.table_phrases.items() if re.search(rf"\b{phrase}\b", words)}
+        named |= self.value_links(f"{question} {plan}")
+        for table in named:
+            scores.setdefault(table, MIN_LINK_SCORE)
+        best = max(scores.values(), default=0.0)
+        if best < MIN_LINK_SCORE:
+            return list(self.table_columns)
+
+        dated = self.has_date_window(f"{question} {plan}")
+        selected = [t for t, s in sorted(scores.items(), key=lambda x: -x[1]) if s > 0.5 * best or t in named]
+        if dated:
+            selected += [t for t in DATE_TABLES if t in self.table_columns and t not in selected]
+
+        connected: Set[str] = {selected[0]}
+        for table in selected[1:]:
+            paths = [self._path(table, other) for other in connected]
+            paths = [p for p in paths if p]
+            if paths:
+                connected.update(min(paths, key=len))
+            else:
+                connected.add(table)
+        return [t for t in self.table_columns if t in connected]
+
+    def render(self, tables: List[str], question_words: Optional[Set[str]] = None, dated: bool = False) -> str:
+        """Renders tables in the get_schema() format, annotating FK columns.
+
+        BLOB columns are dropped. Tables wider than max_columns keep only key, FK and
+        question-matched columns, plus their date columns when dated is set.
+        """
+        schema_str = ""
+        for table in tables:
+            links = {col: ref for col, ref in self.references[table].items() if ref[0] in tables}
+            columns = [(n, t) for n, t in self.table_columns[table] if t.upper() != "BLOB"]
+            if len(columns) > self.max_columns and question_words is not None:
+                columns = [
+                    (n, t) for i, (n, t) in enumerate(columns)
+                    if i == 0 or n in links or set(map(_stem, _split_identifier(n))) & question_words
+                    or (dated and ("DATE" in t.upper() or "TIME" in t.upper() or "date" in _split_identifier(n)))
+                ]
+
+            schema_str += f"Table: {table}\n"
+            for name, col_type in columns:
+                fk = f" -> {links[name][0]}.{links[name][1]}" if name in links else ""
+                schema_str += f"  - {name} ({col_type}){fk}\n"
+            schema_str += "\n"
+        return schema_str
+
+    def prune(self, question: str, plan: str = "", full: bool = False) -> Tuple[str, Dict[str, int]]:
+        """Returns the pruned schema text and its token savings against the full schema.
+
+        With full=True (e.g. SQL repair rounds) or when select_tables() keeps every
+        table, the full schema is returned unpruned.
+        """
+        tables = list(self.table_columns) if full else self.select_tables(question, plan)
+        if len(tables) == len(self.table_columns):
+            schema = self.full_schema
+        else:
+            words = {_stem(w) for w in re.findall(r"[a-z]+", f"{question} {plan}".lower())}
+            schema = self.render(tables, words, dated=self.has_date_window(f"{question} {plan}"))
+        schema_tokens = count_tokens(schema)
+        return schema, {
+            "tables": len(tables),
+            "full_tokens": self.full_tokens,
+            "schema_tokens": schema_tokens,
+            "saved_tokens": max(self.full_tokens - schema_tokens, 0)
+        }
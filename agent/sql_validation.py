@@ -0,0 +1,129 @@
+import difflib
+import re
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+from agent.tools.sqlite_tool import SQLiteTool
+
+FENCE_RE = re.compile(r"```(?:sql|sqlite)?\s*\n?(.*?)```", re.S | re.I)
+LABEL_RE = re.compile(r"^\s*(sql|sqlite|query|sql query)\s*:\s*", re.I)
+SQL_START_RE = re.compile(r"\b(SELECT|WITH)\b", re.I)
+NO_SUCH_TABLE_RE = re.compile(r"no such table: (?:\w+\.)?(.+)$")
+NO_SUCH_COLUMN_RE = re.compile(r"no such column: (?:([\w\"]+)\.)?(.+)$")
+
+def clean_sql(text: str) -> str:
+    """Extracts the SQL statement from LLM output.
+
+    Removes markdown fences and "SQL:" labels, drops any prose before the first
+    SELECT/WITH, and cuts the text after the first complete statement (or at the
+    first blank line when no terminating semicolon is present).
+    """
+    fenced = FENCE_RE.search(text)
+    if fenced:
+        text = fenced.group(1)
+    text = LABEL_RE.sub("", text.strip())
+    start = SQL_START_RE.search(text)
+    if start:
+        text = text[start.start():]
+
+    lines = []
+    for line in text.splitlines():
+        if not line.strip():
+            if lines:
+                break
+            continue
+        lines.append(line)
+        if sqlite3.complete_statement("\n".join(lines)):
+            break
+    sql = "\n".join(lines).strip()
+    # Keep only the first statement when several share a line
+    if sqlite3.complete_statement(sql):
+        for i in range(len(sql)):
+            if sql[i] == ";" and sqlite3.complete_statement(sql[:i + 1]):
+                sql = sql[:i + 1]
+                break
+    return sql
+
+def _replace_identifier(sql: str, wrong: str, right: str) -> str:
+    """Replaces wrong (bare, "quoted", [bracketed] or `backticked`) with "right", leaving string literals alone."""
+    pattern = re.compile(
+        r"'(?:[^']|'')*'|"
+        r"(\"" + re.escape(wrong) + r"\"|\[" + re.escape(wrong) + r"\]|`" + re.escape(wrong) + r"`|"
+        r"(?<![\w\"])" + re.escape(wrong) + r"(?![\w\"]))",
+        re.I
+    )
+    quoted = f'"{right}"' if not re.fullmatch(r"[A-Za-z_]\w*", right) else right
+    return pattern.sub(lambda m: quoted if m.group(1) else m.group(0), sql)
+
+def _closest(name: str, candidates: List[str]) -> Optional[str]:
+    """Case-, space- and underscore-insensitive fuzzy match."""
+    def key(value: str) -> str:
+        return re.sub(r"[\s_]", "", value).lower()
+    keyed = {key(c): c for c in candidates}
+    if key(name) in keyed:
+        return keyed[key(name)]
+    matches = difflib.get_close_matches(key(name), list(keyed), n=1, cutoff=0.75)
+    return keyed[matches[0]] if matches else None
+
+class SQLValidator:
+    """Checks generated SQL with EXPLAIN and applies cheap local fixes.
+
+    Fixes cover markdown fences and trailing prose, unquoted multi-word table names
+    such as Order Details, and misspelled table or column names (fuzzy-matched
+    against the cached schema). EXPLAIN compiles the statement without running it.
+    """
+
+    def __init__(self, db_tool: SQLiteTool, table_columns: Dict[str, List[Tuple[str, str]]], max_fixes: int = 5):
+        self.db_tool = db_tool
+        self.max_fixes = max_fixes
+        self.tables = [t for t in table_columns if not t.startswith("sqlite_")]
+        self.columns = sorted({name for t in self.tables for name, _ in table_columns[t]})
+
+    def _quote_tables(self, sql: str) -> str:
+        for table in self.tables:
+            if " " in table:
+                sql = _replace_identifier(sql, table, table)
+        return sql
+
+    def validate(self, sql: str) -> Tuple[str, Optional[str], List[str]]:
+        """Returns (sql, error, fixes). error is None when the (possibly fixed) SQL compiles."""
+        error = self.db_tool.explain(sql)
+        if error is None:
+            return sql, None, []
+
+        fixes = []
+        cleaned = clean_sql(sql)
+        if cleaned != sql.strip():
+            fixes.append("extracted SQL statement")
+        quoted = self._quote_tables(cleaned)
+        if quoted != cleaned:
+            fixes.append("quoted table names")
+        sql = quoted
+
+        for _ in range(self.max_fixes):
+            error = self.db_tool.explain(sql)
+            if error is None:
+                break
+
+            fixed, fix = None, None
+            table_match = NO_SUCH_TABLE_RE.search(error)
+            column_match = NO_SUCH_COLUMN_RE.search(error)
+            if table_match:
+                wrong = table_match.group(1).strip('"')
+                right = _closest(wrong, self.tables)
+                if right:
+                    fixed, fix = _replace_identifier(sql, wrong, right), f"table {wrong} -> {right}"
+            elif column_match:
+                wrong = column_match.group(2).strip('"')
+                right = _closest(wrong, self.columns)
+                if right and right != wrong:
+                    fixed, fix = _replace_identifier(sql, wrong, right), f"column {wrong} -> {right}"
+
+            if fixed is None or fixed == sql:
+                break
+            sql = fixed
+            fixes.append(fix)
+        else:
+            # max_fixes used up: the last fix has not been checked yet
+            error = self.db_tool.explain(sql)
+
+        return sql, error, fixes
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from dspy.utils.dummies import DummyLM
+# Engine and message types are dspy internals; requirements.txt pins the dspy release they match
+from dspy.clients.engines.dummy_engine import AsyncDummyEngine, DummyEngine
+from dspy.lm15 import Message, Response, TextPart, Usage
+from agent.rag.chunking import count_tokens
+
+# Canned outputs, matched (in order) against the last prompt message by output field name.
+# The SQL prompt also lists the plan field and the synthesizer prompt the SQL, so the
+# more specific markers come first.
+DEFAULT_RESPONSES = {
+    "## final_answer ##": {
+        "reasoning": "Read the answer off the SQL result and the documents.",
+        "final_answer": "0",
+        "explanation": "Stub answer.",
+        "citations": "Orders, kpi_definitions::chunk0"
+    },
+    "## classification ##": {"reasoning": "Mentions both documents and metrics.", "classification": "hybrid"},
+    "## sql_query ##": {
+        "reasoning": "Join order lines to categories and aggregate.",
+        "sql_query": (
+            'SELECT c.CategoryName AS category, SUM(od.Quantity) AS quantity '
+            'FROM "Order Details" od JOIN Products p ON p.ProductID = od.ProductID '
+            'JOIN Categories c ON c.CategoryID = p.CategoryID '
+            'GROUP BY c.CategoryName ORDER BY quantity DESC LIMIT 1'
+        )
+    },
+    "## plan ##": {"reasoning": "Extract dates and the KPI.", "plan": "Use the campaign dates and the KPI formula from the docs."},
+}
+
+def prompt_key(messages: List[Dict[str, Any]]) -> str:
+    return hashlib.sha256(json.dumps(messages, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def save_history(lm, path: str):
+    """Writes the prompts and raw outputs in a dspy LM's history as a replay file for StubLM."""
+    with open(path, "w", encoding="utf-8") as f:
+        for entry in lm.history:
+            if entry.get("messages") and entry.get("outputs"):
+                output = entry["outputs"][0]
+                if isinstance(output, dict):
+                    output = output.get("text", "")
+                f.write(json.dumps({"key": prompt_key(entry["messages"]), "output": output}) + "\n")
+
+class _StubEngine(DummyEngine):
+    def _complete_messages(self, messages):
+        owner = self.owner
+        output = owner.replay.get(prompt_key(messages))
+        with owner.lock:
+            owner.calls += 1
+            owner.replayed += output is not None
+            delay = owner.latency_ms + owner.rng.uniform(-owner.jitter_ms, owner.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+        if output is None:
+            output = next((owner._format_answer_fields(v) for k, v in owner.answers.items()
+                           if k in messages[-1]["content"]), "")
+        prompt_tokens = sum(count_tokens(m.get("content") or "") for m in messages)
+        completion_tokens = count_tokens(output)
+        return Response(id=None, model=owner.model, message=Message.assistant([TextPart(output)]),
+                        finish_reason="stop",
+                        usage=Usage(input_tokens=prompt_tokens, output_tokens=completion_tokens,
+                                    total_tokens=prompt_tokens + completion_tokens))
+
+class StubLM(DummyLM):
+    """Deterministic stand-in for the Ollama LM, for offline benchmarks and smoke runs.
+
+    Prompts found in the replay file (written by save_history) get their recorded
+    output; everything else gets the canned response whose marker appears in the
+    prompt. Each call sleeps latency_ms +/- jitter_ms to simulate model time and
+    reports token usage counted from the prompt and output text.
+    """
+
+    def __init__(
+        self,
+        responses: Optional[Dict[str, Dict[str, Any]]] = None,
+        replay_path: Optional[str] = None,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        seed: int = 0
+    ):
+        super().__init__(dict(responses or DEFAULT_RESPONSES))
+        self.model = "stub"
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.replayed = 0
+        self.replay = {}
+        if replay_path:
+            with open(replay_path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.replay[record["key"]] = record["output"]
+        self._engine_spec = _StubEngine(self)
+        self._async_engine_spec = AsyncDummyEngine(self._engine_spec)
+
+    def copy(self, **kwargs):
+        copied = super().copy(**kwargs)
+        copied._engine_spec = _StubEngine(copied)
+        copied._async_engine_spec = AsyncDummyEngine(copied._engine_spec)
+        return copied
@@ -0,0 +1,295 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Tuple
+
+STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+TABLE_REF_RE = re.compile(
+    r'\b(?:FROM|JOIN)\s+((?:\w+\.)?(?:"[^"]+"|\[[^\]]+\]|`[^`]+`|\w+))'
+    r'(?:\s+(?:AS\s+)?(?!(?:ON|USING|WHERE|JOIN|INNER|LEFT|RIGHT|OUTER|CROSS|NATURAL|GROUP|ORDER|LIMIT|HAVING|UNION)\b)(\w+))?',
+    re.I
+)
+COLUMN_REF_RE = re.compile(r'(?:("[^"]+"|\[[^\]]+\]|`[^`]+`|\b[A-Za-z_]\w*)\s*\.\s*)?("[^"]+"|\[[^\]]+\]|`[^`]+`|\b[A-Za-z_]\w*\b)')
+# Equality against a literal (string literals are replaced by ? first) is a filter; against a column, a join
+FILTER_AFTER_RE = re.compile(r"\s*(?:(?:==?|IS)\s*(?:\?|-?\d)|IN\s*\()", re.I)
+FILTER_BEFORE_RE = re.compile(r"(?:\?|\d)\s*(?:[^<>!]=|==)\s*$")
+JOIN_AFTER_RE = re.compile(r"\s*==?", re.I)
+JOIN_BEFORE_RE = re.compile(r"(?:[^<>!]=|==)\s*$")
+RANGE_AFTER_RE = re.compile(r"\s*(?:<=?|>=?|BETWEEN\b|LIKE\b|GLOB\b)", re.I)
+RANGE_BEFORE_RE = re.compile(r"(?:<=?|>=?)\s*$")
+PLAN_ACCESS_RE = re.compile(r"^(SCAN|SEARCH) (\S+)(?: USING (.*))?$")
+MAX_INDEX_COLUMNS = 8
+
+def _unquote(identifier: str) -> str:
+    if identifier[:1] in "\"[`":
+        return identifier[1:-1]
+    return identifier
+
+def _connect_ro(db_path: str) -> sqlite3.Connection:
+    return sqlite3.connect(Path(db_path).resolve().as_uri() + "?mode=ro", uri=True)
+
+class WorkloadLog:
+    """Appends every query the agent executes to a JSONL file, for the index advisor.
+
+    Lines are written with a single write in append mode, so several worker
+    processes can share one log.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def record(self, sql: str, result: Dict[str, Any]):
+        line = json.dumps({
+            "sql": sql,
+            "elapsed_ms": result.get("elapsed_ms"),
+            "rows": result.get("row_count"),
+            "error": result.get("error")
+        })
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def load_workload(paths: Iterable[str]) -> Counter:
+    """Returns {sql: executions} from workload logs or agent output files (anything with a "sql" field)."""
+    workload = Counter()
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get("sql") and not record.get("error"):
+                    workload[record["sql"].strip()] += 1
+    return workload
+
+class IndexAdvisor:
+    """Proposes covering indexes for a SQL workload from its EXPLAIN QUERY PLAN output.
+
+    Each index is built from the query's own predicates: columns compared with a
+    literal first, then the first range column (e.g. Orders.OrderDate), or the join
+    columns for tables that are only joined; then the other columns the query reads
+    from the table, so the index covers the query and the table rows are never
+    visited. Candidates already contained in a wider one are merged into it.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        # Read-only, like SQLiteTool: a mistyped path fails instead of creating an empty database
+        self.conn = _connect_ro(db_path)
+        self.columns = {}
+        for (table,) in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"):
+            self.columns[table] = [row[1] for row in self.conn.execute(f'PRAGMA table_info("{table}")')]
+
+    def close(self):
+        self.conn.close()
+
+    def query_plan(self, sql: str) -> List[str]:
+        """Returns the detail lines of EXPLAIN QUERY PLAN; raises sqlite3.Error if the SQL does not compile."""
+        return [row[3] for row in self.conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+
+    def _tables(self, sql: str) -> Dict[str, str]:
+        """Returns {alias or table name (lowercase): table} for the tables in the FROM/JOIN clauses."""
+        by_name = {t.lower(): t for t in self.columns}
+        aliases = {}
+        for ref, alias in TABLE_REF_RE.findall(sql):
+            table = by_name.get(_unquote(re.sub(r"^\w+\.", "", ref)).lower())
+            if table is None:
+                continue
+            aliases[table.lower()] = table
+            if alias:
+                aliases[alias.lower()] = table
+        return aliases
+
+    def column_usage(self, sql: str) -> Dict[str, Dict[str, List[str]]]:
+        """Returns {table: {"filter": [...], "range": [...], "join": [...], "other": [...]}} for the columns the SQL uses.
+
+        "filter" columns are compared for equality with a literal, "join" columns with another column.
+        """
+        sql = STRING_LITERAL_RE.sub("?", sql)
+        aliases = self._tables(sql)
+        tables = sorted(set(aliases.values()))
+        usage = {t: {"filter": [], "range": [], "join": [], "other": []} for t in tables}
+
+        for match in COLUMN_REF_RE.finditer(sql):
+            qualifier, name = match.group(1), _unquote(match.group(2))
+            if qualifier:
+                table = aliases.get(_unquote(qualifier).lower())
+                candidates = [table] if table else []
+            else:
+                candidates = [t for t in tables if name.lower() in (c.lower() for c in self.columns[t])]
+            if len(candidates) != 1:
+                continue
+            table = candidates[0]
+            column = next((c for c in self.columns[table] if c.lower() == name.lower()), None)
+            if column is None:
+                continue
+
+            before, after = sql[:match.start()], sql[match.end():]
+            if FILTER_AFTER_RE.match(after) or FILTER_BEFORE_RE.search(before):
+                kind = "filter"
+            elif RANGE_AFTER_RE.match(after) or RANGE_BEFORE_RE.search(before):
+                kind = "range"
+            elif JOIN_AFTER_RE.match(after) or JOIN_BEFORE_RE.search(before):
+                kind = "join"
+            else:
+                kind = "other"
+            if column not in usage[table][kind]:
+                usage[table][kind].append(column)
+        return usage
+
+    def _access_paths(self, plan: List[str], aliases: Dict[str, str]) -> Dict[str, str]:
+        """Returns {table: "scan" | "lookup" | "covered"} from the query plan.
+
+        "lookup" is a search through an index that still visits the table rows;
+        searches by rowid and covering-index reads are "covered".
+        """
+        paths = {}
+        for detail in plan:
+            match = PLAN_ACCESS_RE.match(detail)
+            if not match:
+                continue
+            table = aliases.get(_unquote(match.group(2)).lower())
+            using = match.group(3) or ""
+            if table is None:
+                continue
+            if "COVERING INDEX" in using or "PRIMARY KEY" in using:
+                paths.setdefault(table, "covered")
+            elif match.group(1) == "SCAN":
+                paths[table] = "scan"
+            else:
+                paths.setdefault(table, "lookup")
+        return paths
+
+    def candidates(self, sql: str) -> List[Tuple[str, Tuple[str, ...]]]:
+        """Returns (table, columns) covering-index candidates for this query.
+
+        A table gets a candidate when the query filters it (so the planner can start
+        from the index instead of scanning another table), scans it in full, or looks
+        it up through an index that does not cover the columns read.
+        """
+        plan = self.query_plan(sql)
+        usage = self.column_usage(sql)
+        paths = self._access_paths(plan, self._tables(STRING_LITERAL_RE.sub("?", sql)))
+        proposals = []
+        for table, used in usage.items():
+            filtered = bool(used["filter"] or used["range"])
+            if not filtered and paths.get(table) not in ("scan", "lookup"):
+                continue
+            key = used["filter"] + used["range"][:1] if filtered else used["join"]
+            columns = list(dict.fromkeys(key + used["join"] + used["range"][1:] + used["other"]))
+            if len(columns) > MAX_INDEX_COLUMNS:
+                columns = list(dict.fromkeys(key))
+            if not columns:
+                continue
+            proposals.append((table, tuple(columns)))
+        return proposals
+
+    @staticmethod
+    def index_name(table: str, columns: Tuple[str, ...]) -> str:
+        slug = re.sub(r"\W+", "_", table).strip("_").lower()
+        digest = hashlib.sha1(json.dumps([table, columns]).encode("utf-8")).hexdigest()[:8]
+        return f"idx_advisor_{slug}_{digest}"
+
+    def advise(self, workload: Counter) -> Dict[str, Any]:
+        """Returns {"indexes": [...], "skipped": n} for a {sql: executions} workload."""
+        found = {}
+        skipped = 0
+        for sql, executions in workload.items():
+            try:
+                proposals = self.candidates(sql)
+            except sqlite3.Error:
+                # e.g. queries over the attached KPI rollups, or SQL the agent later repaired
+                skipped += 1
+                continue
+            for table, columns in proposals:
+                entry = found.setdefault((table, columns), {"queries": 0, "executions": 0})
+                entry["queries"] += 1
+                entry["executions"] += executions
+
+        # Fold each candidate into a wider one on the same table with the same leading
+        # column that already holds all of its columns
+        merged = {}
+        for (table, columns), entry in sorted(found.items(), key=lambda item: -len(item[0][1])):
+            target = next((key for key in merged if key[0] == table and key[1][0] == columns[0]
+                           and set(columns) <= set(key[1])), None)
+            if target is None:
+                merged[(table, columns)] = dict(entry)
+            else:
+                merged[target]["queries"] += entry["queries"]
+                merged[target]["executions"] += entry["executions"]
+
+        indexes = []
+        for (table, columns), entry in sorted(merged.items(), key=lambda item: -item[1]["executions"]):
+            name = self.index_name(table, columns)
+            column_list = ", ".join(f'"{c}"' for c in columns)
+            indexes.append({
+                "name": name,
+                "table": table,
+                "columns": list(columns),
+                "sql": f'CREATE INDEX IF NOT EXISTS {name} ON "{table}" ({column_list})',
+                **entry
+            })
+        return {"indexes": indexes, "skipped": skipped}
+
+def copy_database(src_path: str, dest_path: str):
+    """Copies a SQLite database with the backup API (safe while other readers have it open)."""
+    src = _connect_ro(src_path)
+    dest = sqlite3.connect(dest_path)
+    try:
+        src.backup(dest)
+    finally:
+        dest.close()
+        src.close()
+
+def apply_indexes(db_path: str, indexes: List[Dict[str, Any]], workload: Counter) -> List[str]:
+    """Creates the indexes, runs ANALYZE, then drops any the planner does not use. Returns the kept names."""
+    conn = sqlite3.connect(db_path)
+    try:
+        for index in indexes:
+            conn.execute(index["sql"])
+        conn.execute("ANALYZE")
+        used = set()
+        for sql in workload:
+            try:
+                plan = " ".join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}"))
+            except sqlite3.Error:
+                continue
+            used.update(index["name"] for index in indexes if index["name"] in plan)
+        for index in indexes:
+            if index["name"] not in used:
+                conn.execute(f"DROP INDEX IF EXISTS {index['name']}")
+        conn.commit()
+        return [index["name"] for index in indexes if index["name"] in used]
+    finally:
+        conn.close()
+
+def replay(db_path: str, workload: Counter, repeat: int = 5) -> Dict[str, float]:
+    """Times every query in the workload (best of repeat runs). Returns {sql: ms}; failing queries are left out."""
+    conn = sqlite3.connect(db_path)
+    timings = {}
+    try:
+        for sql in workload:
+            best = None
+            try:
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    conn.execute(sql).fetchall()
+                    elapsed = 1000 * (time.perf_counter() - start)
+                    best = elapsed if best is None else min(best, elapsed)
+            except sqlite3.Error:
+                continue
+            timings[sql] = best
+    finally:
+        conn.close()
+    return timings
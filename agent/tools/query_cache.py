@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Iterable, Optional
+
+# Single-quoted strings and double-quoted tokens; SQLite reads "x" as a string literal
+# when no column x exists, so its case can matter too
+_STRING_LITERAL = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+
+def normalize_sql(query: str) -> str:
+    """Normalizes whitespace and case outside quoted tokens so equivalent SQL shares a key."""
+    parts = _STRING_LITERAL.split(query.strip().rstrip(";").strip())
+    normalized = []
+    for i, part in enumerate(parts):
+        if i % 2:
+            # Quoted token: compared case-sensitively by SQLite, keep as-is
+            normalized.append(part)
+        else:
+            normalized.append(re.sub(r"\s+", " ", part).lower())
+    return "".join(normalized).strip()
+
+def _result_size(result: Dict[str, Any]) -> int:
+    return len(repr(result["rows"])) + len(repr(result["columns"]))
+
+class QueryCache:
+    """LRU cache of successful query results, keyed on normalized SQL.
+
+    Entries are evicted when either max_entries or max_bytes is exceeded. An optional
+    on-disk tier (a small SQLite file) keeps results between runs. All entries are
+    tied to a fingerprint of the source database (mtime and size, or a content hash
+    with hash_db=True) and of any watch_paths, the other database files queries can
+    read (e.g. the attached KPI rollups), and are dropped when it changes.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        max_entries: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        disk_path: Optional[str] = None,
+        hash_db: bool = False,
+        watch_paths: Iterable[str] = ()
+    ):
+        self.db_path = db_path
+        self.watch_paths = list(watch_paths)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hash_db = hash_db
+
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+        self._stat_key = None
+        self._fingerprint = self._compute_fingerprint()
+
+        self._disk = None
+        if disk_path:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS query_cache ("
+                "key TEXT PRIMARY KEY, fingerprint TEXT, result TEXT, created REAL)"
+            )
+            # Results computed against another version of the database are stale
+            self._disk.execute("DELETE FROM query_cache WHERE fingerprint != ?", (self._fingerprint,))
+            self._disk.commit()
+
+    def _stat(self):
+        key = []
+        for path in [self.db_path] + self.watch_paths:
+            try:
+                st = os.stat(path)
+                key.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                if path == self.db_path:
+                    raise
+                # A watched file that does not exist yet (e.g. rollups not built)
+                key.append(None)
+        return tuple(key)
+
+    def _compute_fingerprint(self) -> str:
+        self._stat_key = self._stat()
+        if not self.hash_db:
+            return ";".join("-" if k is None else f"{k[0]}:{k[1]}" for k in self._stat_key)
+        digest = hashlib.sha1()
+        for path, k in zip([self.db_path] + self.watch_paths, self._stat_key):
+            if k is None:
+                continue
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+        return digest.hexdigest()
+
+    def _check_fingerprint(self):
+        """Invalidates every entry if the database or a watched file changed. Caller holds the lock."""
+        try:
+            if self._stat() == self._stat_key:
+                return
+        except OSError:
+            return
+        fingerprint = self._compute_fingerprint()
+        if fingerprint == self._fingerprint:
+            return
+
+        self._fingerprint = fingerprint
+        self._entries.clear()
+        self._sizes.clear()
+        self._bytes = 0
+        self.stats["invalidations"] += 1
+        if self._disk is not None:
+            self._disk.execute("DELETE FROM query_cache WHERE fingerprint != ?", (fingerprint,))
+            self._disk.commit()
+
+    def _store(self, key: str, result: Dict[str, Any]):
+        """Inserts into the memory tier and evicts. Caller holds the lock."""
+        size = _result_size(result)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= self._sizes[key]
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        self._sizes[key] = size
+        self._bytes += size
+
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            old_key, _ = self._entries.popitem(last=False)
+            self._bytes -= self._sizes.pop(old_key)
+            self.stats["evictions"] += 1
+
+    def get(self, query: str) -> Optional[Dict[str, Any]]:
+        key = normalize_sql(query)
+        with self._lock:
+            self._check_fingerprint()
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return dict(result)
+
+            if self._disk is not None:
+                row = self._disk.execute(
+                    "SELECT result FROM query_cache WHERE key = ? AND fingerprint = ?",
+                    (key, self._fingerprint)
+                ).fetchone()
+                if row is not None:
+                    result = json.loads(row[0])
+                    result["rows"] = [tuple(r) for r in result["rows"]]
+                    result["error"] = None
+                    self._store(key, result)
+                    self.stats["disk_hits"] += 1
+                    return dict(result)
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, query: str, result: Dict[str, Any]):
+        """Caches a successful result. Results carrying an error are ignored."""
+        if result.get("error"):
+            return
+        key = normalize_sql(query)
+        with self._lock:
+            self._store(key, result)
+            if self._disk is not None:
+                try:
+                    payload = json.dumps({k: v for k, v in result.items() if k != "error"})
+                except TypeError:
+                    # e.g. BLOB columns; keep them in memory only
+                    return
+                try:
+                    self._disk.execute(
+                        "INSERT OR REPLACE INTO query_cache VALUES (?, ?, ?, ?)",
+                        (key, self._fingerprint, payload, time.time())
+                    )
+                    self._disk.commit()
+                except sqlite3.OperationalError:
+                    # Locked by another worker process; the memory tier still has it
+                    self._disk.rollback()
+
+    def hit_rate(self) -> float:
+        total = self.stats["hits"] + self.stats["disk_hits"] + self.stats["misses"]
+        return (self.stats["hits"] + self.stats["disk_hits"]) / total if total else 0.0
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
@@ -0,0 +1,98 @@
+import base64
+import csv
+import io
+import math
+from typing import Any, Dict, List
+from agent.rag.chunking import count_tokens
+
+def json_safe(value: Any) -> Any:
+    """Converts a SQL value or an answer into plain JSON types.
+
+    Tuples become lists, BLOBs become UTF-8 text (or base64 when not text) and
+    NaN/infinite floats become None, so json.dumps never fails or emits NaN.
+    """
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        raw = bytes(value)
+        try:
+            return raw.decode("utf-8")
+        except UnicodeDecodeError:
+            return base64.b64encode(raw).decode("ascii")
+    if isinstance(value, dict):
+        return {str(k): json_safe(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(v) for v in value]
+    return value
+
+def columnar(result: Dict[str, Any]) -> Dict[str, List[Any]]:
+    """Returns {column: [values]} for an execute_query result (duplicate column names get a suffix)."""
+    columns = {}
+    for i, name in enumerate(result.get("columns") or []):
+        key = name if name not in columns else f"{name}_{i}"
+        columns[key] = [row[i] for row in result.get("rows") or []]
+    return columns
+
+def _cell(value: Any) -> Any:
+    value = json_safe(value)
+    if value is None:
+        return "NULL"
+    if isinstance(value, float):
+        return repr(round(value, 4))
+    return value
+
+def _summary(result: Dict[str, Any]) -> List[str]:
+    lines = []
+    for name, values in columnar(result).items():
+        # NULLs and NaN/infinite floats are skipped, so they do not turn a numeric column into text
+        present = [v for v in values if v is not None and not (isinstance(v, float) and not math.isfinite(v))]
+        numbers = [v for v in present if isinstance(v, (int, float)) and not isinstance(v, bool)]
+        if numbers and len(numbers) == len(present):
+            lines.append(f"{name}: min={_cell(min(numbers))} max={_cell(max(numbers))} "
+                         f"sum={_cell(sum(numbers))} mean={_cell(sum(numbers) / len(numbers))}")
+        else:
+            lines.append(f"{name}: {len(set(map(str, values)))} distinct values")
+    return lines
+
+def format_result(result: Dict[str, Any], max_rows: int = 20, tail_rows: int = 5) -> str:
+    """Renders an execute_query result as a compact CSV block for prompts.
+
+    Results with more than max_rows rows show the first max_rows - tail_rows and the
+    last tail_rows rows, followed by per-column aggregates (min/max/sum/mean for
+    numeric columns, distinct counts otherwise) over every fetched row.
+    """
+    if not result:
+        return "no SQL result"
+    if result.get("error"):
+        return f"error: {result['error']}"
+    rows = result.get("rows") or []
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerow(result.get("columns") or [])
+    omitted = len(rows) - max_rows if len(rows) > max_rows else 0
+    shown = rows[:max_rows - tail_rows] + rows[len(rows) - tail_rows:] if omitted else rows
+    for i, row in enumerate(shown):
+        if omitted and i == max_rows - tail_rows:
+            out.write(f"... {omitted} rows omitted ...\n")
+        writer.writerow([_cell(v) for v in row])
+
+    header = f"{len(rows)} row{'' if len(rows) == 1 else 's'}"
+    if result.get("truncated"):
+        header += " (truncated at the fetch limit)"
+    text = header + "\n" + out.getvalue().rstrip("\n")
+    if omitted:
+        text += "\nsummary over all rows:\n" + "\n".join(_summary(result))
+    return text
+
+def result_stats(result: Dict[str, Any], rendered: str) -> Dict[str, int]:
+    """Compares the rendered result with the previous str(result) prompt rendering."""
+    raw = str(result or {})
+    raw_tokens = count_tokens(raw)
+    prompt_tokens = count_tokens(rendered)
+    return {
+        "raw_bytes": len(raw.encode("utf-8")),
+        "prompt_bytes": len(rendered.encode("utf-8")),
+        "raw_tokens": raw_tokens,
+        "prompt_tokens": prompt_tokens,
+        "saved_tokens": max(raw_tokens - prompt_tokens, 0)
+    }
@@ -1,55 +1,249 @@
 import sqlite3
-from typing import List, Dict, Any, Optional
+import threading
+import time
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+from agent.tools.query_cache import QueryCache
+from agent.tracing import record
 
 class SQLiteTool:
-    def __init__(self, db_path: str):
+    """Read-only access to the SQLite database.
+
+    Connections are pooled per thread and reused across calls. Each connection keeps
+    its own LRU of prepared statements (sqlite3's ``cached_statements``), so repeated
+    queries skip re-parsing. An optional QueryCache short-circuits repeated queries.
+
+    execute_query enforces a wall-clock timeout and caps the rows and bytes fetched, so
+    a runaway join cannot hang a worker or exhaust memory.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        cache_size_kb: int = 64 * 1024,
+        mmap_size: int = 256 * 1024 * 1024,
+        statement_cache_size: int = 256,
+        cache: Optional[QueryCache] = None,
+        timeout_seconds: float = 10.0,
+        max_rows: int = 1000,
+        max_result_bytes: int = 1024 * 1024,
+        fetch_size: int = 256
+    ):
         self.db_path = db_path
+        self.cache = cache
+        self.timeout_seconds = timeout_seconds
+        self.max_rows = max_rows
+        self.max_result_bytes = max_result_bytes
+        self.fetch_size = fetch_size
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.statement_cache_size = statement_cache_size
 
-    def get_schema(self) -> str:
-        """Returns the schema of the database."""
-        conn = sqlite3.connect(self.db_path)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: List[sqlite3.Connection] = []
+        self._generation = 0
+        # {alias: path} of extra databases attached (read-only) to every connection
+        self._attached: Dict[str, str] = {}
+        self.stats = {"pool_hits": 0, "pool_misses": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        uri = Path(self.db_path).resolve().as_uri() + "?mode=ro"
+        # check_same_thread=False only so close() can release connections owned by
+        # other threads; each connection is still used by a single thread.
+        conn = sqlite3.connect(
+            uri,
+            uri=True,
+            check_same_thread=False,
+            cached_statements=self.statement_cache_size
+        )
+        for alias, path in self._attached.items():
+            conn.execute(f"ATTACH DATABASE ? AS {alias};", (Path(path).resolve().as_uri() + "?mode=ro",))
+        conn.execute("PRAGMA query_only = ON;")
+        conn.execute(f"PRAGMA cache_size = -{self.cache_size_kb};")
+        conn.execute(f"PRAGMA mmap_size = {self.mmap_size};")
+        return conn
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """Returns this thread's pooled connection, opening one on first use."""
+        conn = getattr(self._local, "conn", None)
+        with self._lock:
+            if conn is not None and self._local.generation == self._generation:
+                self.stats["pool_hits"] += 1
+                return conn
+            self.stats["pool_misses"] += 1
+
+        conn = self._connect()
+        with self._lock:
+            self._connections.append(conn)
+            self._local.conn = conn
+            self._local.generation = self._generation
+        return conn
+
+    def attach(self, alias: str, path: str):
+        """Attaches another SQLite file read-only as alias on every connection, e.g. kpi.window_totals."""
+        with self._lock:
+            self._attached[alias] = path
+            # Existing connections predate the attachment; reopen them on next use
+            self._generation += 1
+
+    def close(self):
+        """Closes every pooled connection. The tool reconnects lazily if used again."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._generation += 1
+        for conn in connections:
+            conn.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def get_table_columns(self) -> Dict[str, List[Tuple[str, str]]]:
+        """Returns {table: [(column, type), ...]} for every table in the database."""
+        conn = self._get_connection()
         cursor = conn.cursor()
-        
+
         # Get list of tables
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
         tables = cursor.fetchall()
-        
-        schema_str = ""
+
+        table_columns = {}
         for table in tables:
             table_name = table[0]
             cursor.execute(f"PRAGMA table_info('{table_name}');")
-            columns = cursor.fetchall()
-            
+            # col[1] is name, col[2] is type
+            table_columns[table_name] = [(col[1], col[2]) for col in cursor.fetchall()]
+
+        cursor.close()
+        return table_columns
+
+    def get_foreign_keys(self) -> List[Tuple[str, str, str, str]]:
+        """Returns (table, column, referenced_table, referenced_column) for every declared foreign key."""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+        tables = [row[0] for row in cursor.fetchall()]
+
+        foreign_keys = []
+        for table_name in tables:
+            cursor.execute(f"PRAGMA foreign_key_list('{table_name}');")
+            # fk[2] is the referenced table, fk[3] the local column, fk[4] the referenced column
+            for fk in cursor.fetchall():
+                foreign_keys.append((table_name, fk[3], fk[2], fk[4]))
+
+        cursor.close()
+        return foreign_keys
+
+    def get_schema(self) -> str:
+        """Returns the schema of the database."""
+        schema_str = ""
+        for table_name, columns in self.get_table_columns().items():
             schema_str += f"Table: {table_name}\n"
-            for col in columns:
-                # col[1] is name, col[2] is type
-                schema_str += f"  - {col[1]} ({col[2]})\n"
+            for name, col_type in columns:
+                schema_str += f"  - {name} ({col_type})\n"
             schema_str += "\n"
-            
-        conn.close()
         return schema_str
 
-    def execute_query(self, query: str) -> Dict[str, Any]:
-        """Executes a SQL query and returns the results."""
+    def explain(self, query: str) -> Optional[str]:
+        """Compiles the query with EXPLAIN without running it. Returns the error message, or None if valid."""
+        try:
+            cursor = self._get_connection().cursor()
+            try:
+                cursor.execute(f"EXPLAIN {query}")
+            finally:
+                cursor.close()
+            return None
+        except Exception as e:
+            return str(e)
+
+    def execute_query(
+        self,
+        query: str,
+        timeout_seconds: Optional[float] = None,
+        max_rows: Optional[int] = None,
+        max_result_bytes: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """Executes a SQL query and returns the results.
+
+        Besides columns/rows/error, the result carries row_count, elapsed_ms,
+        truncated (a row or byte cap was hit) and timed_out.
+        """
+        timeout_seconds = self.timeout_seconds if timeout_seconds is None else timeout_seconds
+        max_rows = self.max_rows if max_rows is None else max_rows
+        max_result_bytes = self.max_result_bytes if max_result_bytes is None else max_result_bytes
+
+        # Cached results are only valid for the default limits they were fetched with
+        use_cache = (
+            self.cache is not None
+            and isinstance(query, str)
+            and (max_rows, max_result_bytes) == (self.max_rows, self.max_result_bytes)
+        )
+        if use_cache:
+            cached = self.cache.get(query)
+            if cached is not None:
+                record(sql_cache_hits=1)
+                return cached
+
+        start = time.perf_counter()
+        deadline = start + timeout_seconds
         try:
-            conn = sqlite3.connect(self.db_path)
-            # Use a row factory to get dictionary-like results if needed, 
+            conn = self._get_connection()
+            # Abort the statement (sqlite3 raises "interrupted") once the deadline passes
+            conn.set_progress_handler(lambda: time.perf_counter() > deadline, 1000)
+            # Use a row factory to get dictionary-like results if needed,
             # but for now we'll stick to tuples and return column names.
             cursor = conn.cursor()
-            cursor.execute(query)
-            
-            columns = [description[0] for description in cursor.description]
-            rows = cursor.fetchall()
-            
-            conn.close()
-            return {
+            try:
+                cursor.execute(query)
+
+                columns = [description[0] for description in cursor.description]
+                rows = []
+                size = 0
+                truncated = False
+                while True:
+                    batch = cursor.fetchmany(self.fetch_size)
+                    if not batch:
+                        break
+                    for row in batch:
+                        size += len(repr(row))
+                        if len(rows) >= max_rows or size > max_result_bytes:
+                            truncated = True
+                            break
+                        rows.append(row)
+                    if truncated:
+                        break
+            finally:
+                cursor.close()
+                conn.set_progress_handler(None, 0)
+
+            result = {
                 "columns": columns,
                 "rows": rows,
-                "error": None
+                "error": None,
+                "row_count": len(rows),
+                "truncated": truncated,
+                "timed_out": False,
+                "elapsed_ms": round(1000 * (time.perf_counter() - start), 2)
             }
+            if use_cache:
+                self.cache.put(query, result)
+            record(sql_ms=result["elapsed_ms"])
+            return result
         except Exception as e:
+            timed_out = isinstance(e, sqlite3.OperationalError) and str(e) == "interrupted"
+            elapsed_ms = round(1000 * (time.perf_counter() - start), 2)
+            record(sql_ms=elapsed_ms)
             return {
                 "columns": [],
                 "rows": [],
-                "error": str(e)
+                "error": f"Query timed out after {timeout_seconds:g}s" if timed_out else str(e),
+                "row_count": 0,
+                "truncated": False,
+                "timed_out": timed_out,
+                "elapsed_ms": elapsed_ms
             }
@@ -0,0 +1,128 @@
+import json
+import math
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+_local = threading.local()
+
+def record(**counters):
+    """Adds counters (tokens, cache hits, SQL time, ...) to the node span running on this thread.
+
+    A no-op when tracing is disabled or when called outside a traced node.
+    """
+    span = getattr(_local, "span", None)
+    if span is None:
+        return
+    for key, value in counters.items():
+        span[key] = span.get(key, 0) + value
+
+def active() -> bool:
+    """True while a traced node is running on this thread."""
+    return getattr(_local, "span", None) is not None
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(pct * len(ordered) / 100) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+class Tracer:
+    """Per-question, per-node tracing for the LangGraph pipeline.
+
+    wrap() times a node and collects the counters reported through record() while it
+    runs. finish() closes a question's trace, appends it to the JSONL trace file and
+    keeps the latencies for summary().
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8") if path else None
+        self._lock = threading.Lock()
+        self._spans: Dict[str, List[Dict[str, Any]]] = {}
+        self.node_ms: Dict[str, List[float]] = {}
+        self.total_ms: List[float] = []
+        # End-to-end latency per route (rag / sql / hybrid)
+        self.class_ms: Dict[str, List[float]] = {}
+        self.totals: Dict[str, float] = {}
+
+    def wrap(self, name: str, fn: Callable) -> Callable:
+        def traced(state):
+            span = {"node": name}
+            parent = getattr(_local, "span", None)
+            _local.span = span
+            start = time.perf_counter()
+            try:
+                return fn(state)
+            finally:
+                span["ms"] = round(1000 * (time.perf_counter() - start), 3)
+                _local.span = parent
+                with self._lock:
+                    self._spans.setdefault(state.get("question_id", ""), []).append(span)
+        return traced
+
+    def finish(self, question_id: str, **fields) -> Dict[str, Any]:
+        """Closes the trace for a question. fields (e.g. total_ms, repair_count) are stored as-is."""
+        with self._lock:
+            spans = self._spans.pop(question_id, [])
+        trace = {"id": question_id, **fields, "nodes": spans}
+        for span in spans:
+            for key, value in span.items():
+                if key not in ("node", "ms"):
+                    trace[key] = trace.get(key, 0) + value
+        self.add(trace)
+        return trace
+
+    def add(self, trace: Dict[str, Any]):
+        """Adds a finished trace (e.g. one shipped back from a worker process) to the stats and the file."""
+        with self._lock:
+            for span in trace["nodes"]:
+                self.node_ms.setdefault(span["node"], []).append(span["ms"])
+                for key, value in span.items():
+                    if key not in ("node", "ms"):
+                        self.totals[key] = self.totals.get(key, 0) + value
+            if "total_ms" in trace:
+                self.total_ms.append(trace["total_ms"])
+                if trace.get("classification"):
+                    self.class_ms.setdefault(trace["classification"], []).append(trace["total_ms"])
+            if self._file is not None:
+                self._file.write(json.dumps(trace, default=str) + "\n")
+                self._file.flush()
+
+    def summary(self) -> str:
+        lines = [f"{'node':<14}{'calls':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+        rows = sorted(self.node_ms.items(), key=lambda item: -sum(item[1]))
+        if self.total_ms:
+            rows.append(("end-to-end", self.total_ms))
+            rows.extend((f"  {name}", values) for name, values in sorted(self.class_ms.items()))
+        for name, values in rows:
+            lines.append(
+                f"{name:<14}{len(values):>7}{percentile(values, 50):>10.1f}"
+                f"{percentile(values, 95):>10.1f}{percentile(values, 99):>10.1f}"
+            )
+        if self.totals:
+            lines.append("totals: " + ", ".join(f"{k}={round(v, 2)}" for k, v in sorted(self.totals.items())))
+        return "\n".join(lines)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class TraceCollector(Tracer):
+    """Tracer for worker processes: finished traces are queued in pending for the parent to add()."""
+
+    def __init__(self):
+        super().__init__()
+        self.pending: List[Dict[str, Any]] = []
+
+    def add(self, trace: Dict[str, Any]):
+        with self._lock:
+            self.pending.append(trace)
+
+    def drain(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            traces, self.pending = self.pending, []
+        return traces
@@ -0,0 +1,188 @@
+import click
+import contextlib
+import json
+import os
+import platform
+import random
+import re
+import resource
+import subprocess
+import time
+import tracemalloc
+import dspy
+from agent.graph_hybrid import HybridAgent
+from agent.stub_lm import StubLM
+from agent.tools.query_cache import QueryCache
+from agent.tracing import Tracer, percentile
+from run_agent_hybrid import process_item, run_ordered
+
+CATEGORIES = ["Beverages", "Condiments", "Confections", "Dairy Products",
+              "Grains/Cereals", "Meat/Poultry", "Produce", "Seafood"]
+CATEGORY_RE = re.compile("|".join(re.escape(c) for c in CATEGORIES))
+YEAR_RE = re.compile(r"\b199[6-8]\b")
+TOP_N_RE = re.compile(r"\bTop (\d+)\b")
+
+def load_templates(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def synthetic_batch(templates, n, seed=0):
+    """Yields n questions built from the templates, varying category, year and top-N.
+
+    Campaign names are left alone so the questions still match the docs.
+    """
+    rng = random.Random(seed)
+    for i in range(n):
+        template = templates[i % len(templates)]
+        question = template["question"]
+        if "'" not in question:
+            question = YEAR_RE.sub(lambda m: str(rng.choice([1996, 1997, 1998])), question)
+        question = CATEGORY_RE.sub(lambda m: rng.choice(CATEGORIES), question)
+        question = TOP_N_RE.sub(lambda m: f"Top {rng.randint(2, 10)}", question)
+        yield {"id": f"{template['id']}-{i}", "question": question, "format_hint": template["format_hint"]}
+
+def latency_stats(values):
+    return {
+        "calls": len(values),
+        "p50_ms": round(percentile(values, 50), 3),
+        "p95_ms": round(percentile(values, 95), 3),
+        "p99_ms": round(percentile(values, 99), 3),
+        "total_ms": round(sum(values), 3)
+    }
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux and bytes on macOS; a process-wide high-water mark
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if platform.system() == "Darwin" else 1024), 1)
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+def run_scale(agent, lm, templates, n, concurrency, sql_cache, trace_memory, seed):
+    """Runs n synthetic questions through a fresh graph and returns the measurements."""
+    tracer = Tracer()
+    agent.tracer = tracer
+    # A fresh result cache per scale so smaller runs do not warm larger ones
+    agent.query_cache.close()
+    agent.query_cache = QueryCache(agent.db_tool.db_path, watch_paths=agent.query_cache.watch_paths)
+    agent.db_tool.cache = agent.query_cache if sql_cache else None
+    app = agent.build_graph()
+    calls_before = lm.calls
+    rollups_before = agent.rollup_stats["matched"]
+
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    failed = 0
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        items = synthetic_batch(templates, n, seed)
+        for res in run_ordered(lambda item: process_item(app, item, tracer), items, concurrency):
+            failed += res["explanation"].startswith("Agent failed")
+    elapsed = time.perf_counter() - start
+    result = {
+        "questions": n,
+        "failed": failed,
+        "elapsed_s": round(elapsed, 3),
+        "questions_per_sec": round(n / elapsed, 2) if elapsed > 0 else 0.0,
+        "end_to_end": latency_stats(tracer.total_ms),
+        "by_class": {name: latency_stats(values) for name, values in sorted(tracer.class_ms.items())},
+        "nodes": {name: latency_stats(values) for name, values in sorted(tracer.node_ms.items())},
+        "sql_ms": round(tracer.totals.get("sql_ms", 0), 3),
+        "retrieval_ms": round(sum(tracer.node_ms.get("retriever", [])), 3),
+        "sql_cache_hit_rate": round(agent.query_cache.hit_rate(), 4) if sql_cache else None,
+        "rollup_matches": agent.rollup_stats["matched"] - rollups_before,
+        "lm_calls": lm.calls - calls_before,
+        "prompt_tokens": tracer.totals.get("prompt_tokens", 0),
+        "completion_tokens": tracer.totals.get("completion_tokens", 0),
+        "peak_rss_mb": peak_rss_mb()
+    }
+    if trace_memory:
+        result["tracemalloc_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+        tracemalloc.stop()
+    return result
+
+def print_comparison(baseline, current):
+    previous = {run["questions"]: run for run in baseline["runs"]}
+    for run in current["runs"]:
+        old = previous.get(run["questions"])
+        if old is None or not old["questions_per_sec"]:
+            continue
+        ratio = run["questions_per_sec"] / old["questions_per_sec"]
+        print(f"{run['questions']:>6} questions: {old['questions_per_sec']:.1f} -> "
+              f"{run['questions_per_sec']:.1f} questions/sec ({ratio:.2f}x), "
+              f"p95 {old['end_to_end']['p95_ms']:.1f} -> {run['end_to_end']['p95_ms']:.1f} ms")
+        for name, stats in run.get("by_class", {}).items():
+            before = old.get("by_class", {}).get(name)
+            if before is None or not before["p50_ms"]:
+                continue
+            change = stats["p50_ms"] / before["p50_ms"] - 1
+            print(f"{'':>6}  {name:<7} p50 {before['p50_ms']:.1f} -> {stats['p50_ms']:.1f} ms ({change:+.0%}), "
+                  f"p95 {before['p95_ms']:.1f} -> {stats['p95_ms']:.1f} ms")
+
+@click.command()
+@click.option('--templates', default='sample_questions_hybrid_eval.jsonl', show_default=True,
+              help='JSONL questions used as templates for the synthetic batches')
+@click.option('--scales', default='10,100,1000', show_default=True,
+              help='Comma-separated batch sizes, e.g. 10,100,1000,10000')
+@click.option('--concurrency', default=1, show_default=True, type=click.IntRange(min=1))
+@click.option('--latency-ms', default=0.0, show_default=True, help='Simulated LM latency per call')
+@click.option('--jitter-ms', default=0.0, show_default=True, help='Uniform +/- jitter on the simulated latency')
+@click.option('--replay', default=None, help='Recorded LM responses to replay (see agent.stub_lm.save_history)')
+@click.option('--no-sql-cache', is_flag=True, help='Run every SQL query against the database')
+@click.option('--no-rollups', is_flag=True, help='Generate all SQL with the LM instead of reading the KPI rollups')
+@click.option('--speculative', is_flag=True, help='Use the latency-optimized graph (parallel routing, retrieval and SQL draft)')
+@click.option('--trace-memory', is_flag=True, help='Also measure the Python heap peak with tracemalloc (slower)')
+@click.option('--seed', default=0, show_default=True)
+@click.option('--out', default='benchmark_results.json', show_default=True, help='Where to save the results')
+@click.option('--compare', default=None, help='Earlier results file to compare against')
+def main(templates, scales, concurrency, latency_ms, jitter_ms, replay, no_sql_cache, no_rollups, speculative,
+         trace_memory, seed, out, compare):
+    """Benchmarks the hybrid agent offline with a stub LM (no Ollama needed)."""
+    lm = StubLM(replay_path=replay, latency_ms=latency_ms, jitter_ms=jitter_ms, seed=seed)
+    dspy.settings.configure(lm=lm, track_usage=True, disable_history=True)
+
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        agent = HybridAgent(db_path="data/northwind.sqlite", docs_dir="docs", llm_cache_path=None,
+                            use_rollups=not no_rollups, speculative=speculative)
+        startup_times = agent.warm_up()
+    startup_s = time.perf_counter() - start
+    print(f"Agent startup: {startup_s:.2f}s")
+
+    question_templates = load_templates(templates)
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "config": {
+            "templates": templates, "concurrency": concurrency, "latency_ms": latency_ms,
+            "jitter_ms": jitter_ms, "replay": replay, "sql_cache": not no_sql_cache,
+            "rollups": not no_rollups, "speculative": speculative, "seed": seed
+        },
+        "startup_s": round(startup_s, 3),
+        "startup_ms": {name: round(1000 * seconds, 2) for name, seconds in startup_times.items()},
+        "runs": []
+    }
+    for n in [int(s) for s in scales.split(",") if s.strip()]:
+        run = run_scale(agent, lm, question_templates, n, concurrency, not no_sql_cache, trace_memory, seed)
+        results["runs"].append(run)
+        e2e = run["end_to_end"]
+        print(f"{n:>6} questions: {run['questions_per_sec']:.1f} questions/sec, "
+              f"p50/p95/p99 {e2e['p50_ms']:.1f}/{e2e['p95_ms']:.1f}/{e2e['p99_ms']:.1f} ms, "
+              f"SQL {run['sql_ms']:.0f} ms, retrieval {run['retrieval_ms']:.0f} ms, "
+              f"peak RSS {run['peak_rss_mb']} MB" + (f", {run['failed']} failed" if run["failed"] else ""))
+
+    agent.close()
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {out}")
+
+    if compare:
+        with open(compare) as f:
+            print_comparison(json.load(f), results)
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,146 @@
-import dspy
+import click
+import copy
+import hashlib
 import json
+import random
+import re
+import threading
+import dspy
 from dspy.teleprompt import BootstrapFewShot
 from agent.dspy_signatures import GenerateSQL, CoT_SQL
 from agent.tools.sqlite_tool import SQLiteTool
+from agent.tools.query_cache import QueryCache, normalize_sql
+from agent.sql_validation import clean_sql
+from run_agent_hybrid import run_ordered
+
+ORDER_BY_RE = re.compile(r"\border\s+by\b", re.I)
+
+class ExecutionMetric:
+    """Scores a predicted SQL query by running it and the gold query and comparing result sets.
+
+    Rows are compared as a multiset (or in order when the gold query has ORDER BY),
+    with floats rounded to float_digits. Column names are ignored. Result
+    fingerprints are cached per normalized SQL, so the gold query of an example is
+    executed once however many candidates are scored against it.
+    """
+
+    def __init__(self, db_tool: SQLiteTool, float_digits: int = 2):
+        self.db_tool = db_tool
+        self.float_digits = float_digits
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+        self.stats = {"fingerprint_hits": 0, "executions": 0}
+
+    def _normalize_row(self, row):
+        return [round(v, self.float_digits) if isinstance(v, float) else v for v in row]
+
+    def fingerprint(self, sql: str, ordered: bool):
+        """Returns a hash of the query's result set, or None if the query fails."""
+        key = (normalize_sql(sql), ordered)
+        with self._lock:
+            if key in self._fingerprints:
+                self.stats["fingerprint_hits"] += 1
+                return self._fingerprints[key]
+            self.stats["executions"] += 1
+
+        result = self.db_tool.execute_query(sql)
+        fingerprint = None
+        if not result["error"]:
+            rows = [json.dumps(self._normalize_row(row), default=str) for row in result["rows"]]
+            if not ordered:
+                rows.sort()
+            fingerprint = hashlib.sha1("\n".join(rows).encode("utf-8")).hexdigest()
+        with self._lock:
+            self._fingerprints[key] = fingerprint
+        return fingerprint
+
+    def __call__(self, example, pred, trace=None) -> bool:
+        sql = clean_sql(pred.sql_query or "")
+        if not sql:
+            return False
+        ordered = bool(ORDER_BY_RE.search(example.sql_query))
+        gold = self.fingerprint(example.sql_query, ordered)
+        return gold is not None and self.fingerprint(sql, ordered) == gold
+
+class ParallelBootstrapFewShot(BootstrapFewShot):
+    """BootstrapFewShot that bootstraps training examples on a thread pool.
+
+    Each example runs on its own copy of the teacher, through the unmodified
+    BootstrapFewShot._bootstrap_one_example. Traces are merged in training-set order
+    and bootstrapping stops at max_bootstrapped_demos, so the selected demos match a
+    serial run with the same (deterministic) LM.
+    """
 
-def validate_sql(example, pred, trace=None):
-    # Basic validation: check if SQL executes without error
-    # In a real scenario, we would check against a gold standard result or more complex logic
-    # Here we just check if it's a non-empty string and maybe if it executes
-    # But we don't have the DB tool easily accessible inside this metric function without passing it
-    # So let's just check if it generated something that looks like SQL
-    sql = pred.sql_query
-    return sql is not None and len(sql) > 10 and "SELECT" in sql.upper()
+    def __init__(self, *args, num_threads: int = 8, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.num_threads = num_threads
 
-def main():
+    def _bootstrap_in_worker(self, example):
+        worker = copy.copy(self)
+        worker.teacher = self.teacher.deepcopy()
+        worker.predictor2name = dict(self.predictor2name)
+        for name, predictor in worker.teacher.named_predictors():
+            worker.predictor2name[id(predictor)] = name
+        worker.name2traces = {name: [] for name in self.name2predictor}
+        for round_idx in range(self.max_rounds):
+            if worker._bootstrap_one_example(example, round_idx):
+                return round_idx + 1, worker.name2traces
+        return self.max_rounds, None
+
+    def _bootstrap(self, *, max_bootstraps=None):
+        max_bootstraps = max_bootstraps or self.max_bootstrapped_demos
+        bootstrap_attempts = 0
+        bootstrapped = {}
+        example_idx = -1
+        self.name2traces = {name: [] for name in self.name2predictor}
+
+        results = run_ordered(self._bootstrap_in_worker, self.trainset, self.num_threads)
+        for example_idx, (attempts, traces) in enumerate(results):
+            bootstrap_attempts += attempts
+            if traces is not None:
+                bootstrapped[example_idx] = True
+                for name, demos in traces.items():
+                    self.name2traces[name].extend(demos)
+            if len(bootstrapped) >= max_bootstraps:
+                break
+        results.close()
+
+        print(
+            f"Bootstrapped {len(bootstrapped)} full traces after {example_idx + 1} examples "
+            f"for up to {self.max_rounds} rounds, amounting to {bootstrap_attempts} attempts."
+        )
+        self.validation = [x for idx, x in enumerate(self.trainset) if idx not in bootstrapped]
+        random.Random(0).shuffle(self.validation)
+
+@click.command()
+@click.option('--train', default='train_examples.json', show_default=True, help='Training examples (question, sql_query)')
+@click.option('--out', default='agent/optimized_sql_gen.json', show_default=True)
+@click.option('--threads', default=8, show_default=True, type=click.IntRange(min=1),
+              help='Examples bootstrapped and scored in parallel')
+@click.option('--lm-cache-dir', default='.dspy_cache', show_default=True,
+              help='On-disk cache of LM calls, reused by later optimizer runs')
+@click.option('--sql-cache', default='optimize_sql_cache.sqlite', show_default=True,
+              help='On-disk cache of gold and candidate SQL results')
+def main(train, out, threads, lm_cache_dir, sql_cache):
     # Setup
+    dspy.configure_cache(enable_disk_cache=True, disk_cache_dir=lm_cache_dir)
     try:
         lm = dspy.LM(model='ollama/phi3.5:3.8b-mini-instruct-q4_K_M', api_base='http://localhost:11434', max_tokens=1000)
     except Exception as e:
         print(f"Failed to initialize DSPy LM: {e}")
         raise e
-        
+
     dspy.settings.configure(lm=lm)
-    
+
     # Load Data
-    with open('train_examples.json', 'r') as f:
+    with open(train, 'r') as f:
         raw_data = json.load(f)
-    
+
     # We need to provide the schema to the examples as inputs
-    db_tool = SQLiteTool("data/northwind.sqlite")
+    db_path = "data/northwind.sqlite"
+    db_tool = SQLiteTool(db_path, cache=QueryCache(db_path, disk_path=sql_cache))
     schema = db_tool.get_schema()
-    
+
     trainset = []
     for item in raw_data:
         trainset.append(dspy.Example(
@@ -38,20 +148,23 @@ def main():
             db_schema=schema,
             sql_query=item['sql_query']
         ).with_inputs('question', 'db_schema'))
-        
-    # Define Module to Optimize
-    # We want to optimize CoT_SQL
-    # But CoT_SQL wraps GenerateSQL. BootstrapFewShot works on modules.
-    
-    # Optimizer
-    teleprompter = BootstrapFewShot(metric=validate_sql, max_bootstrapped_demos=4, max_labeled_demos=4)
-    
+
+    # Optimizer: a bootstrapped demo is kept only if its SQL returns the gold result set
+    metric = ExecutionMetric(db_tool)
+    teleprompter = ParallelBootstrapFewShot(
+        metric=metric, max_bootstrapped_demos=4, max_labeled_demos=4, num_threads=threads
+    )
+
     print("Compiling (optimizing) CoT_SQL...")
     optimized_sql_gen = teleprompter.compile(CoT_SQL(), trainset=trainset)
-    
+    print(f"SQL metric: {metric.stats['executions']} queries executed, "
+          f"{metric.stats['fingerprint_hits']} result fingerprints reused, "
+          f"{db_tool.cache.hit_rate():.1%} SQL cache hit rate")
+    db_tool.close()
+
     # Save
-    optimized_sql_gen.save("agent/optimized_sql_gen.json")
-    print("Optimization complete. Saved to agent/optimized_sql_gen.json")
+    optimized_sql_gen.save(out)
+    print(f"Optimization complete. Saved to {out}")
 
 if __name__ == '__main__':
     main()
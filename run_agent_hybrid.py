@@ -1,8 +1,11 @@
 import click
 import json
 import os
-import dspy
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from agent.graph_hybrid import HybridAgent
+from agent.tracing import TraceCollector, Tracer
 
 import logging
 
@@ -13,71 +16,359 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+def iter_batch(path, skip_ids=frozenset()):
+    """Yields batch items one at a time so memory does not grow with the batch size."""
+    with open(path, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if item["id"] in skip_ids:
+                continue
+            yield item
+
+def load_done_ids(path):
+    """Returns the IDs already written to an output file, for --resume.
+
+    A trailing partial record (e.g. from a crash mid-write) is truncated away
+    so that appended records start on a clean line.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+
+    with open(path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+
+    for line in data[:end].decode('utf-8').splitlines():
+        try:
+            done.add(json.loads(line)["id"])
+        except (ValueError, KeyError):
+            continue
+    return done
+
+def run_ordered(fn, items, concurrency, executor=None):
+    """Applies fn to items on a thread pool (or the given executor), yielding results in input order.
+
+    At most 2 * concurrency items are in flight, so the input generator is
+    consumed lazily and memory stays bounded. The executor is shut down when done.
+    """
+    if concurrency == 1 and executor is None:
+        for item in items:
+            yield fn(item)
+        return
+
+    with executor or ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= 2 * concurrency:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def make_lm(no_llm_cache):
+    import dspy
+    # Assuming Ollama is running
+    return dspy.LM(model='ollama/phi3.5:3.8b-mini-instruct-q4_K_M', api_base='http://localhost:11434', max_tokens=1000, cache=not no_llm_cache)
+
+def memory_mb():
+    """Returns (peak RSS, current PSS) of this process in MB. PSS counts shared pages
+    (e.g. the memory-mapped index) pro rata, so it is None where /proc is unavailable."""
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    pss = None
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    pss = int(line.split()[1]) / 1024
+                    break
+    except OSError:
+        pass
+    return round(rss, 1), (round(pss, 1) if pss is not None else None)
+
+# Per-process state of a --workers pool, set up by init_worker
+_worker = {}
+
+def init_worker(config):
+    """Process pool initializer: each worker gets its own LM, agent and read-only SQLite connections.
+
+    Only the retrieval index's numpy arrays (postings, weights, IDF, lengths) are
+    memory-mapped from the files the parent built and shared through the page cache;
+    the chunk texts and the vocabulary are JSON, so every worker loads its own copy.
+    """
+    import dspy
+    dspy.settings.configure(lm=make_lm(config["no_llm_cache"]), track_usage=config["trace"])
+    tracer = TraceCollector() if config["trace"] else None
+    agent = HybridAgent(
+        db_path=config["db_path"],
+        docs_dir=config["docs_dir"],
+        query_cache_path=config["query_cache"],
+        llm_cache_path=config["llm_cache"],
+        tracer=tracer,
+        use_rollups=config["rollups"],
+        sql_log_path=config["sql_log"],
+        speculative=config["speculative"]
+    )
+    # Build everything before the first question so busy time measures questions only
+    agent.warm_up()
+    _worker.update(agent=agent, tracer=tracer, count=0, busy_seconds=0.0)
+
+def process_in_worker(item):
+    """Runs one question in a pool worker. Returns (record, traces, worker stats)."""
+    start = time.perf_counter()
+    res = process_item(_worker["agent"].app, item, _worker["tracer"])
+    _worker["count"] += 1
+    _worker["busy_seconds"] += time.perf_counter() - start
+    traces = _worker["tracer"].drain() if _worker["tracer"] is not None else []
+    rss, pss = memory_mb()
+    stats = {"pid": os.getpid(), "questions": _worker["count"], "busy_seconds": _worker["busy_seconds"],
+             "rss_mb": rss, "pss_mb": pss}
+    return res, traces, stats
+
+def build_initial_state(item):
+    return {
+        "question_id": item["id"],
+        "question": item["question"],
+        "format_hint": item["format_hint"],
+        "classification": "",
+        "route_tier": "",
+        "sql_query": None,
+        "schema_stats": {},
+        "sql_fixes": [],
+        "sql_result": None,
+        "result_stats": {},
+        "retrieved_docs": [],
+        "context": "",
+        "context_stats": {},
+        "final_answer": None,
+        "explanation": "",
+        "citations": [],
+        "error": None,
+        "repair_count": 0,
+        "draft": None
+    }
+
+def process_item(app, item, tracer=None):
+    """Runs one question through the graph and returns its output record.
+
+    Errors are caught per question so a single failure does not abort the batch.
+    """
+    print(f"Processing: {item['id']}")
+    start = time.perf_counter()
+    try:
+        final_state = app.invoke(build_initial_state(item))
+    except Exception as e:
+        logging.error(f"Failed {item['id']}: {e}")
+        if tracer is not None:
+            tracer.finish(item["id"], total_ms=round(1000 * (time.perf_counter() - start), 3), error=str(e))
+        return {
+            "id": item["id"],
+            "final_answer": None,
+            "sql": "",
+            "confidence": 0.0,
+            "explanation": f"Agent failed: {str(e)}",
+            "citations": []
+        }
+
+    logging.info(f"Processed {item['id']}. Route: {final_state['classification']} "
+                 f"(tier={final_state.get('route_tier')}). Final Answer: {final_state['final_answer']}")
+    if final_state.get('context_stats'):
+        logging.info(f"Context for {item['id']}: {final_state['context_stats']}")
+    if final_state.get('schema_stats'):
+        logging.info(f"Schema for {item['id']}: {final_state['schema_stats']}")
+    if final_state.get('result_stats'):
+        logging.info(f"SQL result prompt for {item['id']}: {final_state['result_stats']}")
+    if final_state.get('error'):
+        logging.error(f"Error in {item['id']}: {final_state['error']}")
+    if tracer is not None:
+        tracer.finish(
+            item["id"],
+            total_ms=round(1000 * (time.perf_counter() - start), 3),
+            classification=final_state.get("classification"),
+            route_tier=final_state.get("route_tier"),
+            repair_count=final_state.get("repair_count", 0),
+            error=final_state.get("error")
+        )
+
+    return {
+        "id": item["id"],
+        "final_answer": final_state["final_answer"],
+        "sql": final_state["sql_query"] if final_state["sql_query"] else "",
+        "confidence": final_state.get("confidence", 0.0),
+        "explanation": final_state["explanation"],
+        "citations": final_state["citations"]
+    }
+
+def print_agent_stats(agent):
+    """Prints the routing, prompt-size, validation and cache statistics gathered by the agent."""
+    for tier, (tier_count, seconds) in sorted(agent.route_stats.items()):
+        print(f"Router tier '{tier}': {tier_count} questions, avg {1000 * seconds / tier_count:.1f} ms")
+    ctx = agent.context_totals
+    if ctx["questions"]:
+        print(f"Retrieved context: avg {ctx['context_tokens'] / ctx['questions']:.0f} tokens per prompt "
+              f"(was {ctx['raw_tokens'] / ctx['questions']:.0f}), "
+              f"{ctx['raw_tokens'] - ctx['context_tokens']} prompt tokens saved in total for each of the planner and synthesizer calls")
+    sch = agent.schema_totals
+    if sch["calls"]:
+        print(f"SQL schema: avg {sch['schema_tokens'] / sch['calls']:.0f} tokens per GenerateSQL call "
+              f"(full schema {sch['full_tokens'] / sch['calls']:.0f}), "
+              f"{sch['full_tokens'] - sch['schema_tokens']} prompt tokens saved in total")
+    val = agent.validation_stats
+    if val["checked"]:
+        print(f"SQL validation: {val['checked']} checked, {val['valid']} valid as generated, "
+              f"{val['repaired_locally']} fixed locally ({val['repaired_locally']} LLM repair calls avoided), "
+              f"{val['sent_to_llm']} sent to LLM repair")
+    if agent.rollup_stats["matched"]:
+        print(f"KPI rollups: {agent.rollup_stats['matched']} questions answered from precomputed "
+              f"rollups (SQL generation LLM call skipped)")
+    spec = agent.speculation_stats
+    if agent.speculative:
+        print(f"Speculation: {spec['drafts_used']} SQL drafts used, {spec['drafts_discarded']} discarded, "
+              f"{spec['drafts_skipped']} skipped by the fast router, "
+              f"{spec['retrievals_discarded']} retrievals discarded (sql route)")
+    res = agent.result_totals
+    if res["questions"]:
+        print(f"SQL results in synthesizer prompts: avg {res['prompt_tokens'] / res['questions']:.0f} tokens "
+              f"(was {res['raw_tokens'] / res['questions']:.0f}), "
+              f"{(res['raw_bytes'] - res['prompt_bytes']) / res['questions']:.0f} bytes and "
+              f"{(res['raw_tokens'] - res['prompt_tokens']) / res['questions']:.0f} tokens saved per question")
+    syn = agent.synthesis_stats
+    print(f"Synthesizer: {syn['deterministic']} answers mapped directly from SQL results "
+          f"(LLM call skipped), {syn['llm']} via LLM")
+    pool_stats = agent.db_tool.stats
+    print(f"SQLite pool: {pool_stats['pool_hits']} hits, {pool_stats['pool_misses']} misses")
+    cache_stats = agent.query_cache.stats
+    print(f"SQL result cache: {agent.query_cache.hit_rate():.1%} hit rate "
+          f"({cache_stats['hits']} memory hits, {cache_stats['disk_hits']} disk hits, {cache_stats['misses']} misses)")
+    if agent.llm_cache is not None:
+        llm_stats = agent.llm_cache.stats
+        print(f"LLM cache: {agent.llm_cache.hit_rate():.1%} hit rate "
+              f"({llm_stats['hits']} hits, {llm_stats['misses']} misses)")
+
 @click.command()
 @click.option('--batch', required=True, help='Path to input JSONL file')
 @click.option('--out', required=True, help='Path to output JSONL file')
-def main(batch, out):
-    logging.info(f"Starting agent run with batch={batch}, out={out}")
-    
+@click.option('--concurrency', default=1, show_default=True, type=click.IntRange(min=1),
+              help='Number of questions to run through the graph in parallel')
+@click.option('--resume', is_flag=True, help='Append to an existing output file, skipping IDs already done')
+@click.option('--query-cache', default=None, help='Path to an on-disk SQL result cache kept between runs')
+@click.option('--llm-cache', default='llm_cache.sqlite', show_default=True, help='Path to the persistent LLM-call cache')
+@click.option('--no-llm-cache', is_flag=True, help='Bypass all LLM caching, e.g. for evaluation runs')
+@click.option('--trace', default=None, help='Write per-node latency/token traces to this JSONL file')
+@click.option('--profile-startup', is_flag=True, help='Build every component up front and print how long each took')
+@click.option('--workers', default=1, show_default=True, type=click.IntRange(min=1),
+              help='Run questions in N worker processes instead of threads (--concurrency is ignored)')
+@click.option('--no-rollups', is_flag=True, help='Always generate SQL against the base tables, never the KPI rollups')
+@click.option('--sql-log', default=None, help='Append every executed SQL query to this JSONL file (input for advise_indexes.py)')
+@click.option('--speculative', is_flag=True,
+              help='Run routing, retrieval and SQL drafting in parallel to cut per-question latency')
+def main(batch, out, concurrency, resume, query_cache, llm_cache, no_llm_cache, trace, profile_startup, workers, no_rollups,
+         sql_log, speculative):
+    logging.info(f"Starting agent run with batch={batch}, out={out}, concurrency={concurrency}, "
+                 f"workers={workers}, resume={resume}")
+
+    # dspy is slow to import; deferred so --help and the helpers above stay fast
+    import_start = time.perf_counter()
+    import dspy
+    import_seconds = time.perf_counter() - import_start
+
     # Setup DSPy LM
-    # Assuming Ollama is running
     try:
-        lm = dspy.LM(model='ollama/phi3.5:3.8b-mini-instruct-q4_K_M', api_base='http://localhost:11434', max_tokens=1000)
+        lm = make_lm(no_llm_cache)
     except Exception as e:
         logging.error(f"Failed to initialize DSPy LM: {e}")
         raise e
-        
-    dspy.settings.configure(lm=lm)
-    
+
+    # Token usage is only tracked (and reported to the trace) when tracing is on
+    dspy.settings.configure(lm=lm, track_usage=bool(trace))
+    tracer = Tracer(trace) if trace else None
+
     # Initialize Agent
     agent = HybridAgent(
         db_path="data/northwind.sqlite",
-        docs_dir="docs"
+        docs_dir="docs",
+        query_cache_path=query_cache,
+        llm_cache_path=None if no_llm_cache else llm_cache,
+        tracer=tracer,
+        use_rollups=not no_rollups,
+        sql_log_path=sql_log,
+        speculative=speculative
     )
-    app = agent.build_graph()
-    
-    results = []
-    
-    with open(batch, 'r') as f:
-        for line in f:
-            item = json.loads(line)
-            print(f"Processing: {item['id']}")
-            
-            initial_state = {
-                "question": item["question"],
-                "format_hint": item["format_hint"],
-                "classification": "",
-                "sql_query": None,
-                "sql_result": None,
-                "retrieved_docs": [],
-                "final_answer": None,
-                "explanation": "",
-                "citations": [],
-                "error": None,
-                "repair_count": 0
-            }
-            
-            final_state = app.invoke(initial_state)
-            
-            logging.info(f"Processed {item['id']}. Final Answer: {final_state['final_answer']}")
-            if final_state.get('error'):
-                logging.error(f"Error in {item['id']}: {final_state['error']}")
-            
-            output = {
-                "id": item["id"],
-                "final_answer": final_state["final_answer"],
-                "sql": final_state["sql_query"] if final_state["sql_query"] else "",
-                "confidence": final_state.get("confidence", 0.0),
-                "explanation": final_state["explanation"],
-                "citations": final_state["citations"]
-            }
-            results.append(output)
-            
-    # Write results
-    with open(out, 'w') as f:
+    if profile_startup:
+        startup_times = {"import dspy": import_seconds, **agent.warm_up()}
+        print("Startup time by component:")
+        for name, seconds in startup_times.items():
+            print(f"  {name:<14}{1000 * seconds:>9.1f} ms")
+        print(f"  {'total':<14}{1000 * sum(startup_times.values()):>9.1f} ms")
+
+    done_ids = load_done_ids(out) if resume else set()
+    if done_ids:
+        print(f"Resuming: skipping {len(done_ids)} questions already in {out}")
+
+    worker_stats = {}
+    if workers > 1:
+        # Build (or validate) the memory-mapped index and the KPI rollups once here,
+        # so workers only map the index and find the rollups up to date
+        agent.retriever
+        agent.rollups
+        config = {
+            "db_path": "data/northwind.sqlite",
+            "docs_dir": "docs",
+            "query_cache": query_cache,
+            "llm_cache": None if no_llm_cache else llm_cache,
+            "no_llm_cache": no_llm_cache,
+            "trace": bool(trace),
+            "rollups": not no_rollups,
+            "sql_log": sql_log,
+            "speculative": speculative
+        }
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(config,))
+        results = run_ordered(process_in_worker, iter_batch(batch, done_ids), workers, executor)
+    else:
+        # The compiled graph is stateless between invocations, so one instance can be
+        # shared by all threads. Built on first use unless warmed up above.
+        app = agent.app
+        results = run_ordered(lambda item: process_item(app, item, tracer), iter_batch(batch, done_ids), concurrency)
+
+    # Each record is flushed as soon as it is ready
+    count = 0
+    start = time.perf_counter()
+    with open(out, 'a' if resume else 'w') as f:
         for res in results:
+            if workers > 1:
+                res, traces, stats = res
+                worker_stats[stats["pid"]] = stats
+                for trace_record in traces:
+                    tracer.add(trace_record)
             f.write(json.dumps(res) + "\n")
-            
+            f.flush()
+            count += 1
+    elapsed = time.perf_counter() - start
+
+    throughput = count / elapsed if elapsed > 0 else 0.0
+    logging.info(f"Processed {count} questions in {elapsed:.2f}s ({throughput:.2f} questions/sec)")
+    print(f"Processed {count} questions in {elapsed:.2f}s ({throughput:.2f} questions/sec)")
+    if workers > 1:
+        # Agent statistics live in the worker processes; report what each worker did
+        for pid, stats in sorted(worker_stats.items()):
+            busy = stats["busy_seconds"]
+            pss = f", PSS {stats['pss_mb']} MB" if stats["pss_mb"] is not None else ""
+            print(f"Worker {pid}: {stats['questions']} questions, "
+                  f"{stats['questions'] / busy if busy > 0 else 0.0:.2f} questions/sec while busy, "
+                  f"peak RSS {stats['rss_mb']} MB{pss}")
+    else:
+        print_agent_stats(agent)
+    agent.close()
+    if tracer is not None:
+        print("Per-node latency (ms):")
+        print(tracer.summary())
+        tracer.close()
+        print(f"Traces written to {trace}")
     print(f"Done. Results written to {out}")
 
 if __name__ == '__main__':
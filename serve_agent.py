@@ -0,0 +1,252 @@
+import asyncio
+import bisect
+import itertools
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+import click
+from aiohttp import web
+from agent.graph_hybrid import HybridAgent
+from agent.tracing import percentile
+from run_agent_hybrid import make_lm, process_item
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000]
+
+class QueueFull(Exception):
+    pass
+
+class AgentServer:
+    """Serves a warm HybridAgent to concurrent HTTP callers.
+
+    Requests wait in a bounded queue. A batcher task drains it in micro-batches
+    (up to max_batch questions, or whatever arrived within batch_window_ms), scores
+    the batch's retrieval in one pass and dispatches the questions to a thread pool
+    together, so their LM calls reach the model concurrently. At most concurrency
+    questions are in flight; once the queue is also full, new requests are rejected
+    so callers back off instead of piling up.
+    """
+
+    def __init__(
+        self,
+        agent: HybridAgent,
+        max_queue: int = 256,
+        max_batch: int = 16,
+        batch_window_ms: float = 10.0,
+        concurrency: int = 8
+    ):
+        self.agent = agent
+        self.max_queue = max_queue
+        self.max_batch = max_batch
+        self.batch_window = batch_window_ms / 1000
+        self.concurrency = concurrency
+        self.metrics = {
+            "requests": 0, "questions": 0, "completed": 0, "failed": 0,
+            "rejected": 0, "batches": 0, "batched_questions": 0, "in_flight": 0
+        }
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.recent_ms = deque(maxlen=10000)
+        self._ids = itertools.count(1)
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._batcher: Optional[asyncio.Task] = None
+        self._pool = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def start(self, app=None):
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._batcher = asyncio.create_task(self._run_batches())
+
+    async def stop(self, app=None):
+        if self._batcher is not None:
+            self._batcher.cancel()
+            try:
+                await self._batcher
+            except asyncio.CancelledError:
+                pass
+        self._pool.shutdown(wait=True)
+        self.agent.close()
+
+    def free_slots(self) -> int:
+        return self.max_queue - self._queue.qsize()
+
+    def submit(self, item: Dict[str, Any]) -> "asyncio.Future":
+        """Queues one question. Raises QueueFull when the queue is at capacity."""
+        item = {"id": item.get("id") or f"q{next(self._ids)}", "question": item["question"],
+                "format_hint": item.get("format_hint", "")}
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((item, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.metrics["rejected"] += 1
+            raise QueueFull()
+        self.metrics["questions"] += 1
+        return future
+
+    async def _next_batch(self) -> List:
+        """Waits for one question, then gathers more for up to batch_window while slots are free."""
+        await self._slots.acquire()
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.batch_window
+        while len(batch) < self.max_batch and not self._slots.locked():
+            if not self._queue.empty():
+                await self._slots.acquire()
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            await self._slots.acquire()
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                self._slots.release()
+                break
+        return batch
+
+    async def _run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            self.metrics["batches"] += 1
+            self.metrics["batched_questions"] += len(batch)
+            # One scoring pass for the whole batch; the router and retriever nodes reuse it
+            questions = [item["question"] for item, _, _ in batch]
+            try:
+                await loop.run_in_executor(self._pool, self.agent.retriever.prefetch, questions)
+            except Exception as e:
+                logging.error(f"Batch retrieval failed: {e}")
+            for item, future, queued_at in batch:
+                self.metrics["in_flight"] += 1
+                task = loop.run_in_executor(self._pool, process_item, self.agent.app, item, self.agent.tracer)
+                task.add_done_callback(lambda done, future=future, queued_at=queued_at: self._finish(done, future, queued_at))
+
+    def _finish(self, done, future, queued_at):
+        self._slots.release()
+        self.metrics["in_flight"] -= 1
+        elapsed_ms = 1000 * (time.perf_counter() - queued_at)
+        self.histogram[bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+        self.recent_ms.append(elapsed_ms)
+        if done.exception() is not None:
+            self.metrics["failed"] += 1
+            if not future.done():
+                future.set_exception(done.exception())
+            return
+        record = done.result()
+        if record["explanation"].startswith("Agent failed"):
+            self.metrics["failed"] += 1
+        self.metrics["completed"] += 1
+        if not future.done():
+            future.set_result(record)
+
+    def snapshot(self) -> Dict[str, Any]:
+        recent = list(self.recent_ms)
+        buckets = [f"le_{bound}" for bound in LATENCY_BUCKETS_MS] + ["inf"]
+        batches = self.metrics["batches"]
+        return {
+            **self.metrics,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "queue_capacity": self.max_queue,
+            "avg_batch_size": round(self.metrics["batched_questions"] / batches, 2) if batches else 0.0,
+            "latency_ms": {
+                "p50": round(percentile(recent, 50), 1),
+                "p95": round(percentile(recent, 95), 1),
+                "p99": round(percentile(recent, 99), 1),
+                "histogram": dict(zip(buckets, self.histogram))
+            }
+        }
+
+def _parse_items(body: Any) -> List[Dict[str, Any]]:
+    items = body if isinstance(body, list) else [body]
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get("question"), str):
+            raise ValueError("each question needs a 'question' string (plus optional 'id' and 'format_hint')")
+        for key in ("id", "format_hint"):
+            if key in item and not isinstance(item[key], str):
+                raise ValueError(f"'{key}' must be a string")
+    return items
+
+def make_app(server: AgentServer) -> web.Application:
+    """Builds the aiohttp application: POST /ask, GET /metrics and GET /health."""
+    routes = web.RouteTableDef()
+
+    @routes.post("/ask")
+    async def ask(request):
+        # A single question object returns one record, a list returns records in order
+        try:
+            body = await request.json()
+            items = _parse_items(body)
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+        server.metrics["requests"] += 1
+
+        # Batches that could never fit are a client error; a full queue is temporary
+        if len(items) > server.max_queue:
+            server.metrics["rejected"] += len(items)
+            return web.json_response({"error": f"batch of {len(items)} exceeds the queue size of {server.max_queue}"},
+                                     status=413)
+        # A batch is accepted whole or not at all
+        if len(items) > server.free_slots():
+            server.metrics["rejected"] += len(items)
+            return web.json_response({"error": "queue full, retry later"}, status=503,
+                                     headers={"Retry-After": "1"})
+        try:
+            futures = [server.submit(item) for item in items]
+        except QueueFull:
+            return web.json_response({"error": "queue full, retry later"}, status=503,
+                                     headers={"Retry-After": "1"})
+        records = await asyncio.gather(*futures)
+        return web.json_response(records if isinstance(body, list) else records[0])
+
+    @routes.get("/metrics")
+    async def metrics(request):
+        return web.json_response(server.snapshot())
+
+    @routes.get("/health")
+    async def health(request):
+        return web.json_response({"status": "ok"})
+
+    app = web.Application()
+    app.add_routes(routes)
+    app.on_startup.append(server.start)
+    app.on_cleanup.append(server.stop)
+    return app
+
+@click.command()
+@click.option('--host', default='127.0.0.1', show_default=True)
+@click.option('--port', default=8080, show_default=True)
+@click.option('--concurrency', default=8, show_default=True, type=click.IntRange(min=1),
+              help='Questions run through the graph at the same time')
+@click.option('--max-batch', default=16, show_default=True, type=click.IntRange(min=1),
+              help='Largest micro-batch taken from the queue at once')
+@click.option('--batch-window-ms', default=10.0, show_default=True, help='How long to wait for a micro-batch to fill')
+@click.option('--max-queue', default=256, show_default=True, type=click.IntRange(min=1),
+              help='Questions allowed to wait; beyond this requests get HTTP 503')
+@click.option('--query-cache', default=None, help='Path to an on-disk SQL result cache kept between runs')
+@click.option('--llm-cache', default='llm_cache.sqlite', show_default=True, help='Path to the persistent LLM-call cache')
+@click.option('--no-llm-cache', is_flag=True, help='Bypass all LLM caching')
+@click.option('--speculative', is_flag=True, help='Run routing, retrieval and SQL drafting in parallel per question')
+def main(host, port, concurrency, max_batch, batch_window_ms, max_queue, query_cache, llm_cache, no_llm_cache,
+         speculative):
+    import dspy
+    dspy.settings.configure(lm=make_lm(no_llm_cache))
+
+    agent = HybridAgent(
+        db_path="data/northwind.sqlite",
+        docs_dir="docs",
+        query_cache_path=query_cache,
+        llm_cache_path=None if no_llm_cache else llm_cache,
+        speculative=speculative
+    )
+    # Pay the full startup once, before the first request
+    startup_times = agent.warm_up()
+    print(f"Agent ready in {sum(startup_times.values()):.2f}s")
+
+    server = AgentServer(agent, max_queue=max_queue, max_batch=max_batch,
+                         batch_window_ms=batch_window_ms, concurrency=concurrency)
+    web.run_app(make_app(server), host=host, port=port)
+
+if __name__ == '__main__':
+    main()
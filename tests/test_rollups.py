@@ -0,0 +1,57 @@
+import json
+from pathlib import Path
+import pytest
+from agent.rollups import match_rollup
+
+WINDOWS = {
+    "Summer Beverages 1997": ("1997-06-01", "1997-06-30"),
+    "Winter Classics 1997": ("1997-12-01", "1997-12-31"),
+    "1996": ("1996-01-01", "1996-12-31"),
+    "1997": ("1997-01-01", "1997-12-31"),
+    "1998": ("1998-01-01", "1998-12-31"),
+    "all": (None, None),
+}
+CATEGORIES = ["Beverages", "Condiments", "Confections", "Dairy Products"]
+KPIS = ["revenue", "quantity", "orders", "aov", "gross_margin"]
+SAMPLES = Path(__file__).resolve().parent.parent / "sample_questions_hybrid_eval.jsonl"
+
+def _match(question, format_hint):
+    return match_rollup(question, format_hint, WINDOWS, CATEGORIES, KPIS)
+
+def test_sample_kpi_questions_match():
+    with open(SAMPLES, encoding="utf-8") as f:
+        samples = {row["id"]: row for row in map(json.loads, f)}
+    expected = {
+        "hybrid_top_category_qty_summer_1997": "FROM kpi.window_category WHERE window_name = 'Summer Beverages 1997'",
+        "hybrid_aov_winter_1997": "FROM kpi.window_totals WHERE window_name = 'Winter Classics 1997'",
+        "sql_top3_products_by_revenue_alltime": "FROM kpi.window_product WHERE window_name = 'all' ORDER BY revenue DESC LIMIT 3",
+        "hybrid_revenue_beverages_summer_1997": "AND category = 'Beverages'",
+        "hybrid_best_customer_margin_1997": "FROM kpi.window_customer WHERE window_name = '1997'",
+    }
+    for sample_id, fragment in expected.items():
+        sample = samples[sample_id]
+        sql = _match(sample["question"], sample["format_hint"])
+        assert sql is not None and fragment in sql, sample_id
+    rag = samples["rag_policy_beverages_return_days"]
+    assert _match(rag["question"], rag["format_hint"]) is None
+
+@pytest.mark.parametrize("question,format_hint", [
+    ("How many units of Chai were sold in 1997?", "int"),
+    ("Total revenue from Chai in 1997", "float"),
+    ("revenue in 1997 from orders with a discount", "float"),
+    ("Total revenue from the 'Beverages' category during 'Summer Beverages 1997' before discounts. "
+     "Return a float rounded to 2 decimals.", "float"),
+    ("Total revenue in 1997 not from Beverages?", "float"),
+    ("What was the AOV in 1997 if Beverages is not the category?", "float"),
+    ("Total revenue in 1997 excluding Beverages", "float"),
+    ("Total revenue in 1997 from categories other than Beverages", "float"),
+    ("Top customer by gross margin in 1997? Return {customer:str, margin:float}.", "{customer:str, margin:float}"),
+    ("How many orders had revenue in 1997?", "int"),
+    ("How many customers had revenue in 1997?", "int"),
+])
+def test_unrecognised_filters_do_not_match(question, format_hint):
+    assert _match(question, format_hint) is None
+
+def test_order_count_reads_the_orders_measure():
+    sql = _match("How many orders were placed in 1997? Return an integer.", "int")
+    assert sql == "SELECT orders FROM kpi.window_totals WHERE window_name = '1997'"
@@ -0,0 +1,53 @@
+from agent.schema_linking import SchemaLinker
+
+TABLE_COLUMNS = {
+    "Categories": [("CategoryID", "INTEGER"), ("CategoryName", "TEXT"), ("Description", "TEXT"), ("Picture", "BLOB")],
+    "Customers": [("CustomerID", "TEXT"), ("CompanyName", "TEXT"), ("ContactName", "TEXT"), ("City", "TEXT"),
+                  ("Country", "TEXT")],
+    "Employees": [("EmployeeID", "INTEGER"), ("LastName", "TEXT"), ("FirstName", "TEXT"), ("HireDate", "DATETIME")],
+    "Order Details": [("OrderID", "INTEGER"), ("ProductID", "INTEGER"), ("UnitPrice", "NUMERIC"),
+                      ("Quantity", "INTEGER"), ("Discount", "REAL")],
+    "Orders": [("OrderID", "INTEGER"), ("CustomerID", "TEXT"), ("EmployeeID", "INTEGER"), ("OrderDate", "DATETIME"),
+               ("RequiredDate", "DATETIME"), ("ShippedDate", "DATETIME"), ("ShipVia", "INTEGER"),
+               ("Freight", "NUMERIC"), ("ShipName", "TEXT"), ("ShipAddress", "TEXT"), ("ShipCity", "TEXT"),
+               ("ShipRegion", "TEXT"), ("ShipPostalCode", "TEXT"), ("ShipCountry", "TEXT")],
+    "Products": [("ProductID", "INTEGER"), ("ProductName", "TEXT"), ("SupplierID", "INTEGER"),
+                 ("CategoryID", "INTEGER"), ("UnitPrice", "NUMERIC"), ("Discontinued", "TEXT")],
+    "Shippers": [("ShipperID", "INTEGER"), ("CompanyName", "TEXT"), ("Phone", "TEXT")],
+    "Suppliers": [("SupplierID", "INTEGER"), ("CompanyName", "TEXT"), ("Country", "TEXT")],
+}
+FOREIGN_KEYS = [
+    ("Order Details", "OrderID", "Orders", "OrderID"),
+    ("Order Details", "ProductID", "Products", "ProductID"),
+    ("Orders", "CustomerID", "Customers", "CustomerID"),
+    ("Orders", "EmployeeID", "Employees", "EmployeeID"),
+    ("Products", "SupplierID", "Suppliers", "SupplierID"),
+    ("Products", "CategoryID", "Categories", "CategoryID"),
+]
+VALUES = {
+    "Products": ["Chai", "Chang", "Tofu", "Ikura"],
+    "Categories": ["Beverages", "Produce", "Seafood"],
+    "Customers": ["Alfreds Futterkiste", "Around the Horn"],
+}
+
+def _linker():
+    return SchemaLinker(TABLE_COLUMNS, FOREIGN_KEYS, values=VALUES, window_names=["Summer Beverages 1997"])
+
+def test_product_value_links_products():
+    tables = _linker().select_tables("Who is the supplier of Chai?")
+    assert {"Suppliers", "Products"} <= set(tables)
+
+def test_stemmed_verb_and_value_link_the_join_path():
+    tables = _linker().select_tables("List customers who ordered Tofu.")
+    assert {"Customers", "Orders", "Order Details", "Products"} <= set(tables)
+
+def test_date_window_keeps_orders_and_order_date():
+    linker = _linker()
+    schema, _ = linker.prune("Total revenue from the 'Beverages' category during 'Summer Beverages 1997' dates.")
+    assert "Table: Orders" in schema and "OrderDate" in schema
+
+def test_unlinked_question_and_repair_rounds_get_the_full_schema():
+    linker = _linker()
+    assert linker.select_tables("Tell me something") == list(TABLE_COLUMNS)
+    schema, stats = linker.prune("How many customers are from France?", full=True)
+    assert schema == linker.full_schema and stats["saved_tokens"] == 0
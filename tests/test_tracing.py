@@ -0,0 +1,13 @@
+from agent.tracing import percentile
+
+def test_percentile_nearest_rank():
+    values = [5, 1, 4, 2, 3, 6, 8, 7, 10, 9]
+    assert percentile(values, 50) == 5
+    assert percentile(values, 70) == 7
+    assert percentile(values, 90) == 9
+    assert percentile(values, 95) == 10
+    assert percentile(values, 100) == 10
+    assert percentile(values, 0) == 1
+    assert percentile([3, 1, 2, 4], 50) == 2
+    assert percentile([7], 99) == 7
+    assert percentile([], 50) == 0.0